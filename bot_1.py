@@ -4,7 +4,7 @@ import asyncio
 
 from bot_config import (
     bot, dp, WEBHOOK_MODE, WEBHOOK_PORT,
-    init_sync_service, init_tmk_service, init_mis_health_guard, reminder_handler
+    init_sync_service, init_tmk_service, init_mis_health_guard, reminder_handler, registration_handler
 )
 import bot_config
 # Импортируем обработчики для регистрации
@@ -15,9 +15,13 @@ from bot_utils import (
     stop_all_tasks, send_other_options_menu
 )
 from logging_config import log_system_event
+from patient_api_client import init_session as init_patient_api_session, close_session as close_patient_api_session
+from sync_appointments.cancel_service import CancelService
 
 # Устанавливаем функцию для reminder_handler
 reminder_handler.send_other_options_menu = send_other_options_menu
+# Устанавливаем функцию для registration_handler
+registration_handler.send_welcome_message = bot_handlers.send_welcome_message
 
 
 async def main():
@@ -42,6 +46,9 @@ async def main():
     # Инициализация сервиса ТМК
     init_tmk_service()
 
+    # Общая HTTP-сессия API пациентов (используется при регистрации)
+    await init_patient_api_session()
+
     # Инициализация и запуск health-check МИС
     init_mis_health_guard()
     mis_health_task = None
@@ -139,6 +146,14 @@ async def main():
             bot_config.mis_health_guard.stop()
             log_system_event("mis_health", "worker_stopped")
 
+        # Дописываем логи чатов поддержки, ожидающие отложенного сохранения
+        bot_config.support_handler.flush_chat_logs()
+
+        # Закрываем общую HTTP-сессию API пациентов
+        await close_patient_api_session()
+        # Закрываем общую HTTP-сессию SOAP-отмены записей
+        await CancelService.close_session()
+
 
 if __name__ == "__main__":
     try:
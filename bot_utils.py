@@ -407,16 +407,16 @@ async def send_pending_notifications():
     
     try:
         for user_id, chat_info in list(support_handler.active_chats.items()):
-            if 'pending_notification' in chat_info:
-                notification = chat_info['pending_notification']
+            notification = chat_info.pending_notification
+            if notification is not None:
                 try:
-                    target_chat_id = chat_info.get('chat_id', user_id)
+                    target_chat_id = chat_info.chat_id or user_id
                     try:
                         set_logging_user_id(user_id)
                         await bot.send_message(chat_id=target_chat_id, text=notification)
                     finally:
                         clear_logging_user_id()
-                    del chat_info['pending_notification']
+                    chat_info.pending_notification = None
                 except Exception as e:
                     log_system_event("support_chat", "send_notification_error",
                                      error=str(e), user_id=user_id)
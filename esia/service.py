@@ -4,8 +4,8 @@
 """
 import os
 import asyncio
-from typing import Optional, Dict
-from datetime import datetime
+from typing import Optional, Dict, List
+from datetime import date
 from dotenv import load_dotenv
 from logging_config import log_system_event, log_data_event, log_user_event
 from user_database import db
@@ -25,6 +25,14 @@ MAX_CHECK_ATTEMPTS = int(os.getenv("ESIA_MAX_CHECK_ATTEMPTS", "20"))
 # Интервал между проверками (в секундах)
 CHECK_INTERVAL = int(os.getenv("ESIA_CHECK_INTERVAL", "6"))
 
+# Коды пола в файле ЕСИА
+_GENDER_CODES = {"1": "Мужской", "2": "Женский"}
+
+# Ожидающие файла ЕСИА: user_id -> future, которые получат путь к файлу
+_waiters: Dict[int, List[asyncio.Future]] = {}
+# Общая задача опроса папки ЕСИА (работает, пока есть ожидающие)
+_watch_task: Optional[asyncio.Task] = None
+
 
 def generate_esia_url(user_id: int) -> str:
     """
@@ -73,9 +81,35 @@ async def check_esia_file(user_id: int) -> Optional[str]:
     return None
 
 
+async def _watch_esia_dir() -> None:
+    """
+    Общий цикл опроса папки ЕСИА для всех ожидающих пользователей.
+    Раз в CHECK_INTERVAL читает список файлов (один listdir вместо проверки файла каждым ожидающим)
+    и отдает путь ожидающим, чей файл появился. Завершается, когда ожидающих не осталось.
+    """
+    global _watch_task
+    try:
+        while _waiters:
+            await asyncio.sleep(CHECK_INTERVAL)
+            try:
+                names = set(await asyncio.to_thread(os.listdir, ESIA_FILES_PATH))
+            except (OSError, TypeError) as e:
+                log_system_event("esia", "dir_list_error", error=str(e), error_type=type(e).__name__)
+                continue
+
+            for user_id in [uid for uid in _waiters if f"{uid}.txt" in names]:
+                file_path = get_esia_file_path(user_id)
+                log_system_event("esia", "file_found", user_id=user_id, file_path=file_path)
+                for future in _waiters.pop(user_id):
+                    if not future.done():
+                        future.set_result(file_path)
+    finally:
+        _watch_task = None
+
+
 async def wait_for_esia_file(user_id: int) -> Optional[str]:
     """
-    Ожидает появления файла ЕСИА с повторными проверками
+    Ожидает появления файла ЕСИА (до MAX_CHECK_ATTEMPTS проверок с интервалом CHECK_INTERVAL)
     
     Args:
         user_id: ID пользователя
@@ -83,21 +117,35 @@ async def wait_for_esia_file(user_id: int) -> Optional[str]:
     Returns:
         Путь к файлу, если он появился, иначе None
     """
+    global _watch_task
     log_system_event("esia", "waiting_for_file_start", user_id=user_id, attempts=MAX_CHECK_ATTEMPTS)
-    
-    for attempt in range(1, MAX_CHECK_ATTEMPTS + 1):
-        file_path = await check_esia_file(user_id)
-        
-        if file_path:
-            log_system_event("esia", "file_appeared", user_id=user_id, attempt=attempt)
-            return file_path
-        
-        if attempt < MAX_CHECK_ATTEMPTS:
-            await asyncio.sleep(CHECK_INTERVAL)
-            log_system_event("esia", "file_check_attempt", user_id=user_id, attempt=attempt)
-    
-    log_system_event("esia", "file_not_found_after_attempts", user_id=user_id, attempts=MAX_CHECK_ATTEMPTS)
-    return None
+
+    # Первая проверка - сразу, без ожидания общего цикла
+    file_path = await check_esia_file(user_id)
+    if file_path:
+        log_system_event("esia", "file_appeared", user_id=user_id, attempt=1)
+        return file_path
+
+    future = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(user_id, []).append(future)
+    if _watch_task is None:
+        _watch_task = asyncio.create_task(_watch_esia_dir())
+
+    try:
+        file_path = await asyncio.wait_for(future, timeout=CHECK_INTERVAL * (MAX_CHECK_ATTEMPTS - 1))
+        log_system_event("esia", "file_appeared", user_id=user_id)
+        return file_path
+    except asyncio.TimeoutError:
+        log_system_event("esia", "file_not_found_after_attempts", user_id=user_id, attempts=MAX_CHECK_ATTEMPTS)
+        return None
+    finally:
+        # Снимаем ожидание (при таймауте или отмене задачи)
+        user_futures = _waiters.get(user_id)
+        if user_futures is not None:
+            if future in user_futures:
+                user_futures.remove(future)
+            if not user_futures:
+                del _waiters[user_id]
 
 
 def parse_esia_file(file_path: str, fallback_phone: Optional[str] = None) -> Optional[Dict[str, str]]:
@@ -167,10 +215,11 @@ def parse_esia_file(file_path: str, fallback_phone: Optional[str] = None) -> Opt
                            file_path=file_path)
             return None
         
-        # Преобразование даты: 1984-12-13 -> 13.12.1984
+        # Преобразование даты: 1984-12-13 -> 13.12.1984 (date() проверяет корректность дня и месяца)
         try:
-            birth_date_obj = datetime.strptime(birth_date_raw, "%Y-%m-%d")
-            birth_date = birth_date_obj.strftime("%d.%m.%Y")
+            year, month, day = map(int, birth_date_raw.split('-'))
+            date(year, month, day)
+            birth_date = f"{day:02d}.{month:02d}.{year:04d}"
         except ValueError as e:
             log_system_event("esia", "file_parse_error", 
                            error=f"Invalid date format: {birth_date_raw}, {str(e)}",
@@ -178,11 +227,8 @@ def parse_esia_file(file_path: str, fallback_phone: Optional[str] = None) -> Opt
             return None
         
         # Преобразование пола: 1 -> Мужской, 2 -> Женский
-        if gender_code == "1":
-            gender = "Мужской"
-        elif gender_code == "2":
-            gender = "Женский"
-        else:
+        gender = _GENDER_CODES.get(gender_code)
+        if gender is None:
             log_system_event("esia", "file_parse_error", 
                            error=f"Invalid gender code: {gender_code}",
                            file_path=file_path)
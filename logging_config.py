@@ -3,7 +3,10 @@ import logging
 import logging.handlers
 import os
 import re
+import queue
+import atexit
 import contextvars
+from types import MappingProxyType
 
 # Кастомные уровни логирования
 USER_LEVEL = 25
@@ -23,49 +26,63 @@ logging.addLevelName(TRANSPORT_LEVEL, "TRANSPORT")
 current_user_id_ctx = contextvars.ContextVar("current_user_id", default=None)
 
 
-class MaskingFilter(logging.Filter):
-    """Фильтр для маскирования персональных данных в логах"""
-
-    def mask_phone(self, phone):
-        if phone and len(phone) >= 8:
-            return phone[:4] + '*' * (len(phone) - 7) + phone[-3:]
-        return phone
-
-    def mask_fio(self, fio):
-        if not fio:
-            return fio
-        parts = fio.split()
-        if len(parts) >= 3:
-            if len(parts[0]) > 2:
-                parts[0] = parts[0][:3] + '***'
-            if len(parts[1]) > 1:
-                parts[1] = parts[1][:1] + '***'
-            if len(parts[2]) > 3:
-                parts[2] = '***' + parts[2][-3:]
-        return ' '.join(parts)
-
-    def filter(self, record):
+# Шаблоны персональных данных (компилируются один раз при импорте)
+_PHONE_RE = re.compile(r'(\+7\d{10})')
+_FIO_RE = re.compile(r'([А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+)')
+
+
+def mask_phone(phone):
+    if phone and len(phone) >= 8:
+        return phone[:4] + '*' * (len(phone) - 7) + phone[-3:]
+    return phone
+
+
+def mask_fio(fio):
+    if not fio:
+        return fio
+    parts = fio.split()
+    if len(parts) >= 3:
+        if len(parts[0]) > 2:
+            parts[0] = parts[0][:3] + '***'
+        if len(parts[1]) > 1:
+            parts[1] = parts[1][:1] + '***'
+        if len(parts[2]) > 3:
+            parts[2] = '***' + parts[2][-3:]
+    return ' '.join(parts)
+
+
+def mask_text(text):
+    """Маскирует телефоны и ФИО в произвольной строке"""
+    # Маскирование телефонов (без '+7' совпадений быть не может)
+    if '+7' in text:
+        text = _PHONE_RE.sub(lambda m: mask_phone(m.group(1)), text)
+    # Маскирование ФИО: ASCII-строки (большинство логов) не содержат кириллицы,
+    # str.isascii() берет флаг из заголовка строки без прохода регулярным выражением
+    if text.isascii():
+        return text
+    return _FIO_RE.sub(lambda m: mask_fio(m.group(1)), text)
+
+
+class MaskingFormatter(logging.Formatter):
+    """
+    Форматтер, маскирующий персональные данные в итоговой строке лога.
+    Результат кешируется на записи, поэтому при нескольких обработчиках
+    с общим форматтером маскирование выполняется один раз.
+    """
+
+    def format(self, record):
+        cached = record.__dict__.get('_masked_output')
+        if cached is not None and cached[0] is self:
+            return cached[1]
+
+        text = super().format(record)
         try:
-            if hasattr(record, 'msg') and record.msg is not None:
-                # В некоторых местах/библиотеках msg может быть не строкой (например, объект Error).
-                # Приводим к строке, чтобы re.sub не падал.
-                if not isinstance(record.msg, str):
-                    record.msg = str(record.msg)
-            if hasattr(record, 'msg') and record.msg:
-                # Маскирование телефонов
-                phone_pattern = r'(\+7\d{10})'
-                record.msg = re.sub(phone_pattern,
-                                    lambda m: self.mask_phone(m.group(1)),
-                                    record.msg)
-                # Маскирование ФИО
-                fio_pattern = r'([А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+)'
-                record.msg = re.sub(fio_pattern,
-                                    lambda m: self.mask_fio(m.group(1)),
-                                    record.msg)
+            text = mask_text(text)
         except Exception as e:
             # Логируем ошибку маскирования, но не прерываем логирование
             logging.getLogger(__name__).warning(f"Ошибка маскирования данных: {e}")
-        return True
+        record._masked_output = (self, text)
+        return text
 
 
 class BotLoggerUserContextFilter(logging.Filter):
@@ -82,11 +99,13 @@ class BotLoggerUserContextFilter(logging.Filter):
 
         prefix = f"[user_id={user_id}] " if user_id is not None else "[user_id=-] "
 
+        msg = record.msg
+        if msg is None:
+            return True
         try:
-            if hasattr(record, "msg") and record.msg is not None:
-                if not isinstance(record.msg, str):
-                    record.msg = str(record.msg)
-                record.msg = prefix + record.msg
+            if type(msg) is not str:
+                msg = str(msg)
+            record.msg = prefix + msg
         except Exception:
             # Не должен ломать логирование в случае ошибок
             pass
@@ -126,8 +145,8 @@ def setup_logging():
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
 
-    # Форматтер для логов
-    formatter = logging.Formatter(
+    # Форматтер для логов (маскирует персональные данные)
+    formatter = MaskingFormatter(
         '%(asctime)s [%(levelname)s] [%(name)s] %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
@@ -151,27 +170,32 @@ def setup_logging():
     console_handler.setLevel(USER_LEVEL)
     console_handler.setFormatter(formatter)
 
-    # Добавляем фильтр маскирования
-    masking_filter = MaskingFilter()
-    file_handler.addFilter(masking_filter)
-    console_handler.addFilter(masking_filter)
-
-    # Добавляем фильтр, подставляющий user_id для логгера 'bot'
-    bot_user_filter = BotLoggerUserContextFilter()
-    file_handler.addFilter(bot_user_filter)
-    console_handler.addFilter(bot_user_filter)
+    # Запись в файл и консоль выполняется в отдельном потоке: корутины только кладут запись
+    # в очередь и не блокируют event loop на дисковом I/O
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setLevel(TRANSPORT_LEVEL)
+    # Фильтр, подставляющий user_id для логгера 'bot', читает contextvar,
+    # поэтому должен работать в вызывающем коде, а не в потоке записи
+    queue_handler.addFilter(BotLoggerUserContextFilter())
+
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    # При завершении процесса дописываем оставшиеся в очереди записи
+    atexit.register(listener.stop)
 
-    # Добавляем обработчики
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Добавляем обработчик
+    logger.addHandler(queue_handler)
 
     # Тестовое сообщение
-    logging.log(SYSTEM_LEVEL, "Система логирования инициализирована")
+    logger.log(SYSTEM_LEVEL, "Система логирования инициализирована")
 
 
 # Словари переводов для логирования
 USER_EVENT_TRANSLATIONS = {
-    "appointment_cancel_error": {
+    "appointment_cancel_error": MappingProxyType({
         "invalid_payload": "Ошибка отмены записи: некорректный идентификатор записи",
         "service_unavailable": "Ошибка отмены записи: сервис недоступен",
         "not_found": "Ошибка отмены записи: запись не найдена",
@@ -179,16 +203,16 @@ USER_EVENT_TRANSLATIONS = {
         "time_limit_exceeded": "Ошибка отмены записи: превышен лимит времени (более 3 часов)",
         "invalid_confirm_payload": "Ошибка отмены записи: некорректный идентификатор при подтверждении",
         "unknown": "Ошибка отмены записи: неизвестная ошибка"
-    },
+    }),
     "appointment_cancel_confirmation_shown": "Показано подтверждение отмены записи",
     "appointment_cancelled": "Запись отменена",
     "appointment_cancel_failed": "Не удалось отменить запись",
     "appointment_cancel_cancelled": "Отмена записи отменена пользователем",
-    "button_pressed": {
+    "button_pressed": MappingProxyType({
         "cancel_appointment_back": "Нажата кнопка «Назад» в меню отмены записи",
         "other_options": "Нажата кнопка «Другие возможности»",
         "default": "Нажата кнопка"
-    },
+    }),
     "message_sent": "Отправлено сообщение",
     "other_options_menu_opened": "Открыто меню «Другие возможности»",
     "appointments_list_viewed": "Просмотрен список записей",
@@ -227,15 +251,18 @@ USER_EVENT_TRANSLATIONS = {
     "message_ignored_unregistered": "Сообщение проигнорировано (пользователь не зарегистрирован)",
     "visit_doctor_start": "Начат сценарий записи к врачу",
     "visit_doctor_text_input": "Текстовый ввод в сценарии записи",
-    "visit_doctor_action": {
+    "visit_doctor_action": MappingProxyType({
         "doc_person_me": "Выбор: Записать себя",
         "doc_person_other": "Выбор: Записать другого",
         "doc_confirm_patient_data": "Подтверждение данных пациента",
         "doc_confirm_booking": "Подтверждение записи",
         "default": "Действие в сценарии записи"
-    }
+    })
 }
 
+# Действия с вариантами перевода (значение - словарь, а не строка)
+_DICT_ACTIONS = frozenset(k for k, v in USER_EVENT_TRANSLATIONS.items() if isinstance(v, MappingProxyType))
+
 SYSTEM_EVENT_TRANSLATIONS = {
     "appointment": {
         "cancelled": "Запись отменена",
@@ -248,6 +275,8 @@ SYSTEM_EVENT_TRANSLATIONS = {
     },
     "database": {
         "user_db_connected": "Подключено к БД пользователей",
+        "user_db_pool_exhausted": "Нет свободных соединений в пуле БД пользователей",
+        "user_db_rollback_failed": "Ошибка отката транзакции БД пользователей",
         "users_table_initialized": "Таблица пользователей инициализирована",
         "users_table_init_error": "Ошибка инициализации таблицы пользователей",
         "reminders_table_initialized": "Таблица напоминаний инициализирована",
@@ -305,6 +334,7 @@ SYSTEM_EVENT_TRANSLATIONS = {
         "send_admin_notification_error": "Ошибка отправки уведомления админу",
         "send_notifications_error": "Ошибка отправки уведомлений",
         "no_admin_id": "ID администратора не установлен",
+        "invalid_admin_id": "Некорректный ADMIN_ID в настройках",
         "no_bot_for_notification": "Нет бота для уведомления",
         "admin_notified": "Администратор уведомлен о новом чате",
         "notify_admin_error": "Ошибка уведомления администратора",
@@ -317,6 +347,7 @@ SYSTEM_EVENT_TRANSLATIONS = {
         "end_notification_user_error": "Ошибка уведомления пользователя о завершении",
         "end_notification_admin_error": "Ошибка уведомления администратора о завершении",
         "end_chat_notifications_error": "Ошибка уведомлений о завершении чата",
+        "next_user_notification_error": "Ошибка уведомления о следующем пользователе в очереди",
         "create_image_attachment_error": "Ошибка создания вложения изображения",
         "send_queued_message_error": "Ошибка отправки сообщения из очереди",
         "send_queue_header_error": "Ошибка отправки заголовка очереди"
@@ -386,6 +417,9 @@ SYSTEM_EVENT_TRANSLATIONS = {
 
 }
 
+# Параметры системных событий, которые выводятся отдельно и в первую очередь
+_SYSTEM_SPECIAL_KEYS = frozenset({"appointment_id", "error", "chat_id"})
+
 DATA_EVENT_TRANSLATIONS = {
     "confirmation_prepared": "Подготовлено подтверждение данных",
     "registration_completed": "Регистрация завершена",
@@ -404,55 +438,88 @@ SECURITY_EVENT_TRANSLATIONS = {
 }
 
 
+# Действия, у которых ошибка уже отражена в тексте перевода
+_ERROR_IN_TEXT_ACTIONS = frozenset({"appointment_cancel_error", "appointment_cancel_failed"})
+
+
+def _make_static_user_translator(action, base_msg):
+    """Создает переводчик для действия с фиксированным текстом (без вариантов)"""
+    show_error = action not in _ERROR_IN_TEXT_ACTIONS
+
+    def translate(details):
+        detail_parts = []
+        if "appointment_id" in details:
+            detail_parts.append(f"ID записи={details['appointment_id']}")
+        if show_error and "error" in details:
+            detail_parts.append(f"ошибка: {details['error']}")
+        elif "text" in details:
+            detail_parts.append(f"«{details['text']}»")
+
+        if detail_parts:
+            return f"{base_msg} ({', '.join(detail_parts)})"
+        return base_msg
+
+    return translate
+
+
+# Переводчики для действий с фиксированным текстом собираются один раз при импорте
+_USER_DISPATCH = {
+    action: _make_static_user_translator(action, translation)
+    for action, translation in USER_EVENT_TRANSLATIONS.items()
+    if action not in _DICT_ACTIONS
+}
+
+
 def _translate_user_event(action, **details):
     """Переводит событие пользователя на русский"""
-    if action in USER_EVENT_TRANSLATIONS:
+    translator = _USER_DISPATCH.get(action)
+    if translator is not None:
+        return translator(details)
+
+    # Событие с вариантами перевода
+    if action in _DICT_ACTIONS:
         translation = USER_EVENT_TRANSLATIONS[action]
 
-        # Если это словарь (для событий с вариантами)
-        if isinstance(translation, dict):
-            # Проверяем наличие ключа error или payload в details
-            if "error" in details:
-                error_key = details.get("error", "unknown")
-                if error_key in translation:
-                    base_msg = translation[error_key]
-                else:
-                    base_msg = translation.get("default", action)
-            elif "payload" in details:
-                payload = details.get("payload", "")
-                # Проверяем точное совпадение
-                if payload in translation:
-                    base_msg = translation[payload]
-                # Проверяем начало payload (для cancel_appointment:ID и т.д.)
-                elif payload.startswith("cancel_appointment:"):
-                    base_msg = "Нажата кнопка «Отменить запись»"
-                elif payload.startswith("cancel_appointment_confirm:"):
-                    base_msg = "Нажата кнопка «Да» для подтверждения отмены записи"
-                # Добавленная логика для visit_doctor_action wildcards
-                elif payload.startswith("doc_mo_"):
-                    base_msg = "Выбор медицинской организации"
-                elif payload.startswith("doc_spec_"):
-                    base_msg = "Выбор специальности"
-                elif payload.startswith("doc_doc_"):
-                    base_msg = "Выбор врача"
-                elif payload.startswith("doc_date_"):
-                    base_msg = "Выбор даты приема"
-                elif payload.startswith("doc_time_"):
-                    base_msg = "Выбор времени приема"
-                elif payload.startswith("doc_back_"):
-                    base_msg = "Навигация: Назад"
-                else:
-                    base_msg = translation.get("default", action)
+        # Проверяем наличие ключа error или payload в details
+        if "error" in details:
+            error_key = details.get("error", "unknown")
+            if error_key in translation:
+                base_msg = translation[error_key]
+            else:
+                base_msg = translation.get("default", action)
+        elif "payload" in details:
+            payload = details.get("payload", "")
+            # Проверяем точное совпадение
+            if payload in translation:
+                base_msg = translation[payload]
+            # Проверяем начало payload (для cancel_appointment:ID и т.д.)
+            elif payload.startswith("cancel_appointment:"):
+                base_msg = "Нажата кнопка «Отменить запись»"
+            elif payload.startswith("cancel_appointment_confirm:"):
+                base_msg = "Нажата кнопка «Да» для подтверждения отмены записи"
+            # Добавленная логика для visit_doctor_action wildcards
+            elif payload.startswith("doc_mo_"):
+                base_msg = "Выбор медицинской организации"
+            elif payload.startswith("doc_spec_"):
+                base_msg = "Выбор специальности"
+            elif payload.startswith("doc_doc_"):
+                base_msg = "Выбор врача"
+            elif payload.startswith("doc_date_"):
+                base_msg = "Выбор даты приема"
+            elif payload.startswith("doc_time_"):
+                base_msg = "Выбор времени приема"
+            elif payload.startswith("doc_back_"):
+                base_msg = "Навигация: Назад"
             else:
                 base_msg = translation.get("default", action)
         else:
-            base_msg = translation
+            base_msg = translation.get("default", action)
 
         # Формируем детали
         detail_parts = []
         if "appointment_id" in details:
             detail_parts.append(f"ID записи={details['appointment_id']}")
-        if "error" in details and action not in ["appointment_cancel_error", "appointment_cancel_failed"]:
+        if "error" in details and action not in _ERROR_IN_TEXT_ACTIONS:
             detail_parts.append(f"ошибка: {details['error']}")
         elif "payload" in details and action == "button_pressed":
             # payload уже включен в перевод
@@ -494,9 +561,7 @@ def _translate_system_event(component, event, **details):
             if "chat_id" in details:
                 detail_parts.append(f"chat_id={details['chat_id']}")
             # Добавляем все остальные параметры кроме тех что уже обработали
-            for k, v in details.items():
-                if k not in ["appointment_id", "error", "chat_id"]:
-                    detail_parts.append(f"{k}={v}")
+            detail_parts.extend(f"{k}={v}" for k, v in details.items() if k not in _SYSTEM_SPECIAL_KEYS)
 
             if detail_parts:
                 return f"{base_msg} ({', '.join(detail_parts)})"
@@ -539,32 +604,37 @@ def _translate_security_event(event, **details):
     return f"{event} {details_str}" if details_str else event
 
 
+# Логгер событий разрешается один раз: события пишутся в корневой логгер,
+# как и раньше через logging.log, но без поиска root и лишнего вызова на каждую запись
+_event_logger = logging.getLogger()
+
+
 # Утилиты для логирования
 def log_user_event(user_id, action, **details):
     """Логирует действия пользователя"""
     translated_msg = _translate_user_event(action, **details)
-    logging.log(USER_LEVEL, f"[user_id={user_id}] {translated_msg}")
+    _event_logger.log(USER_LEVEL, f"[user_id={user_id}] {translated_msg}")
 
 
 def log_system_event(component, event, **details):
     """Логирует системные события"""
     translated_msg = _translate_system_event(component, event, **details)
-    logging.log(SYSTEM_LEVEL, translated_msg)
+    _event_logger.log(SYSTEM_LEVEL, translated_msg)
 
 
 def log_data_event(user_id, operation, **details):
     """Логирует работу с данными"""
     translated_msg = _translate_data_event(operation, **details)
-    logging.log(DATA_LEVEL, f"[user_id={user_id}] {translated_msg}")
+    _event_logger.log(DATA_LEVEL, f"[user_id={user_id}] {translated_msg}")
 
 
 def log_security_event(user_id, event, **details):
     """Логирует события безопасности"""
     translated_msg = _translate_security_event(event, **details)
-    logging.log(SECURITY_LEVEL, f"[user_id={user_id}] {translated_msg}")
+    _event_logger.log(SECURITY_LEVEL, f"[user_id={user_id}] {translated_msg}")
 
 
 def log_transport_event(method, endpoint, status, **details):
     """Логирует сетевые события"""
     details_str = " ".join([f'{k}={v}' for k, v in details.items()])
-    logging.log(TRANSPORT_LEVEL, f"[{method} {endpoint}] status={status} {details_str}")
\ No newline at end of file
+    _event_logger.log(TRANSPORT_LEVEL, f"[{method} {endpoint}] status={status} {details_str}")
\ No newline at end of file
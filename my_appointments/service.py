@@ -1,4 +1,6 @@
+import asyncio
 import os
+import time
 import uuid
 import aiohttp
 from datetime import datetime
@@ -11,7 +13,7 @@ from bot_utils import create_keyboard
 from logging_config import log_system_event, log_user_event
 from patient_api_client import get_patients_by_phone
 from sync_appointments.cancel_service import CancelService
-from user_database import db
+from user_database import db, run_db
 from visit_a_doctor.soap_parser import SoapResponseParser
 
 load_dotenv()
@@ -20,8 +22,11 @@ SOAP_URL = os.getenv("SOAP_URL")
 SOAP_URL_PATIENT_ID = os.getenv("SOAP_URL_PatientID")
 MY_APPOINTMENTS_LOGGING = os.getenv("MY_APPOINTMENTS_LOGGING", "0")
 PAGE_SIZE = 5
+USER_DATA_CACHE_TTL_SEC = 60
 
 _sessions: Dict[int, Dict[str, Any]] = {}
+# user_id -> (момент чтения, данные пользователя); кнопку "Записи к врачу" часто нажимают повторно
+_user_data_cache: Dict[int, Tuple[float, Dict[str, Any]]] = {}
 
 
 def _norm(s: Any) -> str:
@@ -42,6 +47,21 @@ def _log_mis_io(event: str, **kwargs: Any) -> None:
         pass
 
 
+async def _get_user_data(user_id: int) -> Dict[str, Any]:
+    now = time.monotonic()
+    cached = _user_data_cache.get(user_id)
+    if cached and now - cached[0] < USER_DATA_CACHE_TTL_SEC:
+        return cached[1]
+
+    data = await run_db(db.get_user_full_data, user_id) or {}
+    if data:
+        # Попутно вычищаем устаревшие записи, чтобы кеш не рос бесконечно
+        for uid in [uid for uid, (ts, _) in _user_data_cache.items() if now - ts >= USER_DATA_CACHE_TTL_SEC]:
+            del _user_data_cache[uid]
+        _user_data_cache[user_id] = (now, data)
+    return data
+
+
 def _normalize_birth_date(raw: str) -> str:
     raw = _norm(raw)
     if not raw:
@@ -359,19 +379,20 @@ def _format_appointments_text(appointments: List[Dict[str, Any]], patient: Dict[
     total = len(appointments)
     start = page * PAGE_SIZE
     end = min(total, start + PAGE_SIZE)
-    chunk = appointments[start:end]
-    lines = [f"📋 Записи к врачу\nПациент: {_norm(patient.get('fio'))}\n"]
-    for idx, app in enumerate(chunk, start=1):
-        global_idx = start + idx
-        lines.append(
-            f"Запись #{global_idx}\n"
-            f"🏥 {_norm(app.get('MO_Name'))}\n"
-            f"👨‍⚕️ {_norm(app.get('Specialist_Name'))}\n"
-            f"🚪 {_norm(app.get('Room'))}\n"
-            f"🗓 {_norm(app.get('VisitTime'))}"
-        )
-    lines.append(f"\nСтраница {page + 1} из {max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)}")
-    return "\n\n".join(lines)
+    entries = (
+        f"Запись #{start + idx}\n"
+        f"🏥 {_norm(app.get('MO_Name'))}\n"
+        f"👨‍⚕️ {_norm(app.get('Specialist_Name'))}\n"
+        f"🚪 {_norm(app.get('Room'))}\n"
+        f"🗓 {_norm(app.get('VisitTime'))}"
+        for idx, app in enumerate(appointments[start:end], start=1)
+    )
+    # Заголовок, записи и номер страницы собираются одним join
+    return "\n\n".join((
+        f"📋 Записи к врачу\nПациент: {_norm(patient.get('fio'))}\n",
+        *entries,
+        f"\nСтраница {page + 1} из {max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)}",
+    ))
 
 
 async def _mark_cancelled_locally(user_id: int, book_id_mis: str) -> None:
@@ -438,9 +459,13 @@ async def send_my_appointments(bot: Bot, user_id: int, chat_id: int) -> None:
     Старт сценария "Записи к врачу":
     выбираем пациента и затем показываем записи.
     """
-    user_data = db.get_user_full_data(user_id) or {}
+    user_data = await _get_user_data(user_id)
     phone = _norm(user_data.get("phone"))
-    patients = await get_patients_by_phone(phone)
+    # Запрос к API пациентов и чтение локальных записей независимы - выполняем параллельно
+    patients, local_only = await asyncio.gather(
+        get_patients_by_phone(phone),
+        run_db(_extract_local_patients, user_id),
+    )
     for p in patients:
         p["source"] = "api"
 
@@ -455,7 +480,6 @@ async def send_my_appointments(bot: Bot, user_id: int, chat_id: int) -> None:
     if self_patient["fio"] and not any(_is_same_patient(self_patient, p) for p in patients):
         patients.insert(0, self_patient)
 
-    local_only = _extract_local_patients(user_id)
     for lp in local_only:
         if not any(_is_same_patient(lp, ap) for ap in patients):
             patients.append(lp)
@@ -504,7 +528,7 @@ async def handle_my_appointments_callback(bot: Bot, user_id: int, chat_id: int,
             return True
 
         state["selected_patient"] = patient
-        owner = db.get_user_full_data(user_id) or {}
+        owner = await _get_user_data(user_id)
         phone = _norm(owner.get("phone"))
 
         patient_id = await _get_patient_id_from_soap(patient, phone)
@@ -1,122 +1,290 @@
-import json
 import os
+import re
+import time
 import asyncio
+import logging
 import aiohttp
-from typing import List, Dict, Optional
+import orjson
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from logging_config import log_system_event
+from logging_config import log_system_event, SYSTEM_LEVEL
 
 load_dotenv()
 
 PATIENT_API_URL = os.getenv("PATIENT_API_URL")
 PATIENT_API_USER = os.getenv("PATIENT_API_USER")
 PATIENT_API_PASSWORD = os.getenv("PATIENT_API_PASSWORD")
+# Время жизни кеша ответов по номеру телефона (0 - кеш выключен)
+PATIENT_API_CACHE_TTL_SEC = int(os.getenv("PATIENT_API_CACHE_TTL_SEC", "60"))
+PATIENT_API_CACHE_MAX_SIZE = 1024
+# Предельный размер ответа API: пациентов по одному телефону единицы, больше - явно не наш ответ
+PATIENT_API_MAX_BODY = 1024 * 1024
+# Максимум одновременных соединений к API (keep-alive пул общей сессии)
+PATIENT_API_MAX_CONNECTIONS = int(os.getenv("PATIENT_API_MAX_CONNECTIONS", "50"))
+
+# Конфигурация проверяется один раз при импорте, а не на каждый запрос
+_ENABLED = bool(PATIENT_API_URL and PATIENT_API_USER and PATIENT_API_PASSWORD)
+
+# Заголовок Basic-авторизации вычисляется один раз, а не кодируется в base64 на каждый запрос
+_AUTH_HEADERS: Dict[str, str] = {}
+if _ENABLED:
+    _AUTH_HEADERS = {
+        "Authorization": aiohttp.BasicAuth(login=PATIENT_API_USER, password=PATIENT_API_PASSWORD).encode()
+    }
+
+# Телефон РФ в любом привычном написании: +7/8/без кода, скобки, пробелы, дефисы.
+# Группы - 10 цифр номера без кода страны (формат, который ожидает API)
+_PHONE_RE = re.compile(r'\s*(?:\+?[78])?[\s-]*\(?(\d{3})\)?[\s-]*(\d{3})[\s-]*(\d{2})[\s-]*(\d{2})\s*')
+
+# UTF-8 BOM, который изредка присылает API перед JSON
+_BOM = b'\xef\xbb\xbf'
+
+# Типы ответа, которые заведомо не JSON (HTML-страницы ошибок прокси/сервера)
+_NON_JSON_CONTENT_TYPES = frozenset({'text/html', 'application/xhtml+xml'})
+
+# Код пола в API: "1" - М, "2" - Ж
+_SEX_MAP = {"1": "Мужской", "2": "Женский"}
+
+# Состояние сервиса: 0 - доступен, 1 - недоступен и это уже залогировано (чтобы не логировать каждую попытку).
+# Проверка и смена состояния идут без await между ними, поэтому переход логирует ровно одна корутина
+_svc_state = 0
+
+# Кеш ответов API: телефон (10 цифр как int) -> (момент записи, пациенты); порядок = порядок LRU
+_cache: "OrderedDict[int, Tuple[float, List[Dict[str, Optional[str]]]]]" = OrderedDict()
+
+# Таймауты запроса: короткий connect, чтобы быстро замечать недоступность сервиса
+_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=2, sock_read=8)
+
+# Выполняющиеся запросы к API: телефон (int) -> задача с результатом
+_inflight: Dict[int, "asyncio.Task[Optional[List[Dict[str, Optional[str]]]]]"] = {}
+
+# Общая HTTP-сессия: переиспользует соединения (keep-alive) вместо TCP+TLS на каждый запрос
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Возвращает общую HTTP-сессию, создавая ее при первом обращении"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=PATIENT_API_MAX_CONNECTIONS,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            ),
+            timeout=_TIMEOUT,
+            # API отдает JSON без сжатия: просим identity и не гоняем ответ через распаковку
+            headers={"Accept": "application/json", "Accept-Encoding": "identity"},
+            auto_decompress=False,
+        )
+    return _session
+
+
+async def init_session() -> None:
+    """Создает общую HTTP-сессию заранее (вызывается при запуске бота), чтобы первый запрос не ждал ее создания"""
+    if _ENABLED:
+        await _get_session()
+
+
+async def close_session() -> None:
+    """Закрывает общую HTTP-сессию (вызывается при остановке бота)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _mask(value: str, head: int, tail: int) -> str:
+    """Маскирует середину строки для логов (телефон не пишется в лог целиком)"""
+    if len(value) <= head + tail:
+        return "***"
+    return value[:head] + "***" + value[-tail:]
+
+
+def _log_enabled() -> bool:
+    """Включен ли уровень системных событий - чтобы не собирать аргументы лога впустую"""
+    return logging.getLogger().isEnabledFor(SYSTEM_LEVEL)
+
+
+def _mark_down(event: str, **details) -> None:
+    """Логирует переход сервиса в недоступное состояние (только первый раз)"""
+    global _svc_state
+    if _svc_state == 0:
+        _svc_state = 1
+        log_system_event("patient_api", event, **details)
+
+
+def _mark_up() -> None:
+    """Логирует восстановление сервиса, если до этого он был недоступен"""
+    global _svc_state
+    if _svc_state == 1:
+        _svc_state = 0
+        log_system_event("patient_api", "service_restored")
+
+
+def _cache_get(phone: int) -> Optional[List[Dict[str, Optional[str]]]]:
+    entry = _cache.get(phone)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] >= PATIENT_API_CACHE_TTL_SEC:
+        del _cache[phone]
+        return None
+    _cache.move_to_end(phone)
+    return entry[1]
+
+
+def _cache_put(phone: int, patients: List[Dict[str, Optional[str]]]) -> None:
+    if PATIENT_API_CACHE_TTL_SEC <= 0:
+        return
+    _cache[phone] = (time.monotonic(), patients)
+    _cache.move_to_end(phone)
+    while len(_cache) > PATIENT_API_CACHE_MAX_SIZE:
+        _cache.popitem(last=False)
+
+
+def _to_patient(item: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """Преобразует запись API в нормализованный словарь пациента"""
+    get = item.get
+    # Склеиваем ФИО, пропуская пустые части
+    fio = " ".join(part for part in (
+        (get("LastName") or "").strip(),
+        (get("FirstName") or "").strip(),
+        (get("FatherName") or "").strip(),
+    ) if part)
+    return {
+        "fio": fio,
+        "birth_date": get("Birthday", ""),
+        "snils": get("Snils", ""),
+        "oms": get("PolicyOmsNumber", ""),
+        "gender": _SEX_MAP.get(get("Sex")),
+        # Сохраняем и сырые данные на всякий случай
+        "raw_id": get("UniqueId", "")
+    }
 
-# Флаг для отслеживания недоступности сервиса (чтобы не логировать каждую попытку)
-_service_unavailable_logged = False
 
 async def get_patients_by_phone(phone: str) -> List[Dict[str, str]]:
     """
     Запрашивает данные пациентов по номеру телефона.
     Возвращает список словарей с нормализованными данными.
     """
-    global _service_unavailable_logged
-    
-    if not PATIENT_API_URL or not PATIENT_API_USER or not PATIENT_API_PASSWORD:
-        if not _service_unavailable_logged:
-            log_system_event("patient_api", "configuration_missing")
-            _service_unavailable_logged = True
+    if not _ENABLED:
+        # Логирование настроено позже импорта, поэтому сообщаем при первом вызове (один раз)
+        _mark_down("configuration_missing")
         return []
 
     # Нормализация телефона: API ожидает 10 цифр (без +7/8)
-    clean_phone = ''.join(filter(str.isdigit, phone))
-    if len(clean_phone) == 11 and (clean_phone.startswith('7') or clean_phone.startswith('8')):
-        clean_phone = clean_phone[1:]
-    elif len(clean_phone) != 10:
-        log_system_event("patient_api", "invalid_phone_format", phone=phone[:4] + "***" + phone[-3:] if len(phone) > 7 else "***")
+    match = _PHONE_RE.fullmatch(phone)
+    if match is None:
+        if _log_enabled():
+            log_system_event("patient_api", "invalid_phone_format", phone=_mask(phone, 4, 3))
         return []
+    clean_phone = ''.join(match.groups())
+
+    # Ключ кеша и карты запросов - число: хешируется быстрее строки и занимает меньше памяти
+    key = int(clean_phone)
+    patients = _cache_get(key)
+    if patients is None:
+        patients = await _fetch_coalesced(clean_phone, key)
+        if patients is None:
+            return []
+
+    # Вызывающий код дополняет и сохраняет словари пациентов - отдаем копии, чтобы не портить кеш
+    return [dict(p) for p in patients]
+
+
+async def _fetch_coalesced(clean_phone: str, key: int) -> Optional[List[Dict[str, Optional[str]]]]:
+    """
+    Одновременные запросы по одному телефону ожидают один общий запрос к API.
+    Запрос идет отдельной задачей, поэтому отмена одного из ожидающих не прерывает остальных.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_and_cache(clean_phone, key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
 
-    url = f"{PATIENT_API_URL}"
-    params = {'phone': clean_phone}
-    auth = aiohttp.BasicAuth(login=PATIENT_API_USER, password=PATIENT_API_PASSWORD)
 
+async def _fetch_and_cache(clean_phone: str, key: int) -> Optional[List[Dict[str, Optional[str]]]]:
+    patients = await _fetch_patients(clean_phone)
+    if patients is not None:
+        _cache_put(key, patients)
+    return patients
+
+
+async def _fetch_patients(clean_phone: str) -> Optional[List[Dict[str, Optional[str]]]]:
+    """
+    Выполняет запрос к API пациентов.
+    Возвращает список пациентов или None при ошибке.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, auth=auth, timeout=10) as response:
-                if response.status != 200:
-                    log_system_event("patient_api", "http_error", status=response.status, phone=clean_phone[:3] + "***" + clean_phone[-2:])
-                    return []
-                
-                try:
-                    # Используем utf-8-sig для обработки BOM
-                    text_data = await response.text(encoding='utf-8-sig')
-                    data = json.loads(text_data)
-                except json.JSONDecodeError as e:
-                    log_system_event("patient_api", "parse_error", error=f"JSON decode failed: {str(e)[:100]}")
-                    return []
-                except Exception as e:
-                    log_system_event("patient_api", "parse_error", error=f"Unexpected error: {type(e).__name__}")
-                    return []
-
-                if not isinstance(data, list):
-                    log_system_event("patient_api", "unexpected_format", data_type=type(data).__name__)
-                    return []
+        session = await _get_session()
+        async with session.get(PATIENT_API_URL, params={'phone': clean_phone}, headers=_AUTH_HEADERS) as response:
+            if response.status != 200:
+                if _log_enabled():
+                    log_system_event("patient_api", "http_error", status=response.status, phone=_mask(clean_phone, 3, 2))
+                return None
+            
+            # Страница ошибки прокси/сервера с кодом 200 - не разбираем ее как JSON.
+            # Остальные типы разбираем: API может отдавать JSON как text/plain
+            content_type = response.content_type
+            if content_type in _NON_JSON_CONTENT_TYPES:
+                log_system_event("patient_api", "unexpected_content_type", content_type=content_type)
+                return None
+            if (response.content_length or 0) > PATIENT_API_MAX_BODY:
+                log_system_event("patient_api", "response_too_large", size=response.content_length)
+                return None
+
+            try:
+                # Разбираем байты напрямую, без промежуточной строки; BOM отрезаем вручную
+                raw = await response.read()
+                if raw.startswith(_BOM):
+                    raw = raw[3:]
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError as e:
+                log_system_event("patient_api", "parse_error", error=f"JSON decode failed: {str(e)[:100]}",
+                                 content_type=content_type)
+                return None
+            except Exception as e:
+                log_system_event("patient_api", "parse_error", error=f"Unexpected error: {type(e).__name__}",
+                                 content_type=content_type)
+                return None
+
+            if not isinstance(data, list):
+                log_system_event("patient_api", "unexpected_format", data_type=type(data).__name__)
+                return None
 
+            try:
+                results = [_to_patient(item) for item in data]
+            except Exception:
+                # Есть битые элементы - разбираем поштучно, пропуская их
                 results = []
                 for item in data:
                     try:
-                        # Склеиваем ФИО
-                        last_name = item.get("LastName", "").strip()
-                        first_name = item.get("FirstName", "").strip()
-                        father_name = item.get("FatherName", "").strip()
-                        fio = f"{last_name} {first_name} {father_name}".strip()
-
-                        # Обработка пола "1" - М, "2" - Ж
-                        sex_code = item.get("Sex", "")
-                        gender = None
-                        if sex_code == "1":
-                            gender = "Мужской"
-                        elif sex_code == "2":
-                            gender = "Женский"
-
-                        patient = {
-                            "fio": fio,
-                            "birth_date": item.get("Birthday", ""),
-                            "snils": item.get("Snils", ""),
-                            "oms": item.get("PolicyOmsNumber", ""),
-                            "gender": gender,
-                            # Сохраняем и сырые данные на всякий случай
-                            "raw_id": item.get("UniqueId", "") 
-                        }
-                        results.append(patient)
+                        results.append(_to_patient(item))
                     except Exception as parse_error:
                         log_system_event("patient_api", "item_parse_error", error=type(parse_error).__name__)
-                        continue
-                
-                # Сбрасываем флаг при успешном запросе
-                if _service_unavailable_logged:
-                    _service_unavailable_logged = False
-                    log_system_event("patient_api", "service_restored")
-                
-                return results
+
+            # Сбрасываем состояние при успешном запросе
+            _mark_up()
+
+            return results
 
     except aiohttp.ClientConnectorError:
         # Ошибка подключения - логируем только один раз
-        if not _service_unavailable_logged:
-            log_system_event("patient_api", "connection_failed", url=PATIENT_API_URL if PATIENT_API_URL else "not_configured")
-            _service_unavailable_logged = True
-        return []
-    except (aiohttp.ServerTimeoutError, asyncio.TimeoutError):
-        # Таймаут запроса
-        if not _service_unavailable_logged:
-            log_system_event("patient_api", "timeout_error", url=PATIENT_API_URL if PATIENT_API_URL else "not_configured")
-            _service_unavailable_logged = True
-        return []
+        _mark_down("connection_failed", url=PATIENT_API_URL)
+        return None
+    except asyncio.TimeoutError:
+        # Таймаут запроса (aiohttp.ServerTimeoutError - его подкласс)
+        _mark_down("timeout_error", url=PATIENT_API_URL)
+        return None
     except aiohttp.ClientError as e:
         # Другие ошибки клиента
         log_system_event("patient_api", "client_error", error=type(e).__name__)
-        return []
+        return None
     except Exception as e:
         # Неожиданные ошибки - логируем кратко
         log_system_event("patient_api", "unexpected_error", error=type(e).__name__)
-        return []
+        return None
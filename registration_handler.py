@@ -1,13 +1,16 @@
+import os
 import re
 import asyncio
-from datetime import datetime
-from typing import Dict, Any, Callable, Optional
+from functools import lru_cache, partial
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Any, Callable, Optional, Set, Tuple
 from maxapi import Bot
 from maxapi.types import InputMedia
 
-from user_database import db
+from user_database import db, run_db, DB_EXECUTOR_WORKERS
 from logging_config import log_user_event, log_data_event, log_system_event
-from bot_utils import create_keyboard
+from bot_utils import create_keyboard, send_main_menu
 from patient_api_client import get_patients_by_phone
 from esia import (
     generate_esia_url,
@@ -37,28 +40,202 @@ REJECT_PHONE_CALLBACK = "reject_phone"
 GENDER_MALE_CALLBACK = "gender_male"
 GENDER_FEMALE_CALLBACK = "gender_female"
 
+# Состояния регистрации (ключи user_states[...].state и таблицы обработчиков)
+STATE_WAITING_PHONE_CONFIRMATION = "waiting_phone_confirmation"
+STATE_WAITING_FIO = "waiting_fio"
+STATE_WAITING_BIRTH_DATE = "waiting_birth_date"
+STATE_WAITING_SNILS = "waiting_snils"
+STATE_WAITING_OMS = "waiting_oms"
+STATE_WAITING_GENDER = "waiting_gender"
+STATE_WAITING_IDENTITY_SELECTION = "waiting_identity_selection"
+STATE_WAITING_CONFIRMATION = "waiting_confirmation"
+STATE_WAITING_ESIA = "waiting_esia"
+STATE_WAITING_FIO_CORRECTION = "waiting_fio_correction"
+STATE_WAITING_BIRTH_DATE_CORRECTION = "waiting_birth_date_correction"
+STATE_WAITING_SNILS_CORRECTION = "waiting_snils_correction"
+STATE_WAITING_OMS_CORRECTION = "waiting_oms_correction"
+STATE_WAITING_GENDER_CORRECTION = "waiting_gender_correction"
+
+#_IDENTITY_PROMPT = "🔍 По вашему номеру найдены следующие пациенты.\nКто вы?"
+_IDENTITY_PROMPT = "🔍 На ваш номер зарегистрировано несколько медицинских карт.\nЧтобы пройти регистрацию выберете себя!"
+
+# Поля, без которых регистрацию нельзя завершить
+_REQUIRED_FIELDS = frozenset(('fio', 'birth_date', 'phone', 'snils', 'oms', 'gender'))
+
+# Допустимые значения пола (кнопки выбора пола)
+_VALID_GENDERS = frozenset(("Мужской", "Женский"))
+
+# Валидаторы и сообщения об ошибках для полей регистрации
+_VALIDATORS = {
+    'fio': db.validate_fio,
+    'birth_date': db.validate_birth_date,
+    'phone': db.validate_phone,
+    'snils': db.validate_snils,
+    'oms': db.validate_oms,
+    'gender': db.validate_gender
+}
+
+_VALIDATION_ERRORS = {
+    'fio': "❌ Ошибка формата!\n\nПожалуйста, введите ваше ФИО в формате: Фамилия Имя Отчество\n\nПример: Иванов Иван Иванович",
+    'birth_date': "❌ Ошибка формата!\n\nПожалуйста, введите дату рождения в формате: ДД.ММ.ГГГГ\n\nПример: 13.03.2003",
+    'phone': "❌ Неверный формат номера телефона.",
+    'snils': "❌ Неверный формат СНИЛС (нужно 11 цифр).",
+    'oms': "❌ Неверный формат ОМС (должен содержать от 10 до 20 цифр).",
+    'gender': "❌ Неверный формат пола."
+}
+
+# Состояние, событие лога и подсказка для исправления каждого поля
+_CORRECTION_CONFIGS = {
+    'fio': {
+        'state': STATE_WAITING_FIO_CORRECTION,
+        'log_event': 'fio_correction_requested',
+        'message': "Введите ваше ФИО для исправления:\n\nФормат: Фамилия Имя Отчество\nПример: Иванов Иван Иванович"
+    },
+    'birth_date': {
+        'state': STATE_WAITING_BIRTH_DATE_CORRECTION,
+        'log_event': 'birth_date_correction_requested',
+        'message': "Введите вашу дату рождения для исправления:\n\nФормат: ДД.ММ.ГГГГ\nПример: 13.03.2003"
+    },
+    'snils': {
+        'state': STATE_WAITING_SNILS_CORRECTION,
+        'log_event': 'snils_correction_requested',
+        'message': "Введите ваш СНИЛС для исправления (11 цифр)."
+    },
+    'oms': {
+        'state': STATE_WAITING_OMS_CORRECTION,
+        'log_event': 'oms_correction_requested',
+        'message': "Введите ваш полис ОМС для исправления (от 10 до 20 цифр)."
+    },
+    'gender': {
+        'state': STATE_WAITING_GENDER_CORRECTION,
+        'log_event': 'gender_correction_requested',
+        'message': "Выберите ваш пол для исправления:"
+    }
+}
+
+# Общий пустой список кандидатов для чтения (неизменяемый, поэтому его можно разделять).
+# Для data так не делаем: обработчики дописывают поля в полученный словарь
+_NO_CANDIDATES = ()
+
+# Ограничение одновременных записей регистрации в БД. Все запросы к БД из асинхронного кода
+# идут через ограниченный пул потоков run_db (по соединению на поток), и регистрации
+# занимают не больше половины его потоков, чтобы не задерживать остальные запросы
+_DB_SEM = asyncio.Semaphore(max(1, DB_EXECUTOR_WORKERS // 2))
+
+# Номер телефона из vCard контакта и очистка его от всего, кроме цифр и '+'
+_TEL_RE = re.compile(r'TEL[^:]*:([^\r\n]+)')
+_NON_PHONE_CHARS_RE = re.compile(r'[^\d+]')
+# Таблица для str.translate: удаляет все ASCII-символы, кроме цифр и '+'
+_PHONE_KEEP = str.maketrans('', '', ''.join(chr(c) for c in range(128) if not (chr(c).isdigit() or chr(c) == '+')))
+
+# Статичные клавиатуры регистрации собираются один раз при импорте
+_KB_GENDER = create_keyboard([[
+    {'type': 'callback', 'text': 'Мужской', 'payload': GENDER_MALE_CALLBACK},
+    {'type': 'callback', 'text': 'Женский', 'payload': GENDER_FEMALE_CALLBACK}
+]])
+_KB_CONTACT = create_keyboard([[
+    {'type': 'contact', 'text': '📇 Отправить контакт'}
+]])
+_KB_AGREEMENT = create_keyboard([[
+    {'type': 'callback', 'text': 'Согласие на обработку персональных данных', 'payload': AGREEMENT_CALLBACK}
+]])
+_KB_PHONE_CONFIRM = create_keyboard([[
+    {'type': 'callback', 'text': '✅ Да, номер верный', 'payload': CONFIRM_PHONE_CALLBACK},
+    {'type': 'callback', 'text': '❌ Нет, неверный номер', 'payload': REJECT_PHONE_CALLBACK}
+]])
+
+
+def _as_attachments(keyboard) -> list:
+    """Список вложений из одной клавиатуры (пустой, если клавиатуру собрать не удалось)"""
+    return [keyboard] if keyboard else []
+
+
+# Готовые списки вложений для статичных клавиатур (только читаются при отправке)
+_ATT_GENDER = _as_attachments(_KB_GENDER)
+_ATT_CONTACT = _as_attachments(_KB_CONTACT)
+_ATT_PHONE_CONFIRM = _as_attachments(_KB_PHONE_CONFIRM)
+
+
+# Строки клавиатуры подтверждения данных.
+# Кнопки редактирования показываем только если данные НЕ из РМИС
+_CORRECTION_ROWS = [
+    [{'type': 'callback', 'text': '⚠️ Исправить ФИО', 'payload': CORRECT_FIO_CALLBACK}],
+    [{'type': 'callback', 'text': '⚠️ Исправить дату рождения', 'payload': CORRECT_BIRTH_DATE_CALLBACK}],
+    [{'type': 'callback', 'text': '⚠️ Исправить СНИЛС', 'payload': CORRECT_SNILS_CALLBACK}],
+    [{'type': 'callback', 'text': '⚠️ Исправить ОМС', 'payload': CORRECT_OMS_CALLBACK}],
+    [{'type': 'callback', 'text': '⚠️ Исправить пол', 'payload': CORRECT_GENDER_CALLBACK}]
+]
+# Данные из РМИС - редактирование запрещено, но можно сообщить об ошибке
+_RMS_ERROR_ROWS = [[{'type': 'callback', 'text': '❌ Нашли ошибку?', 'payload': "reg_incorrect_data"}]]
+_CONFIRM_ROWS = [[{'type': 'callback', 'text': '✅ Всё верно, подтвердить', 'payload': CONFIRM_DATA_CALLBACK}]]
+# Если есть список кандидатов, добавляем кнопку "Назад"
+_BACK_ROWS = [[{'type': 'callback', 'text': '🔙 Назад к выбору', 'payload': 'reg_back_to_list'}]]
+
+# (данные из РМИС, есть список кандидатов) -> клавиатура
+_KB_CONFIRMATION = {
+    (is_from_rms, has_candidates): create_keyboard(
+        (_RMS_ERROR_ROWS if is_from_rms else _CORRECTION_ROWS) + _CONFIRM_ROWS + (_BACK_ROWS if has_candidates else [])
+    )
+    for is_from_rms in (False, True)
+    for has_candidates in (False, True)
+}
+_ATT_CONFIRMATION = {key: _as_attachments(kb) for key, kb in _KB_CONFIRMATION.items()}
+
+# Текст экрана входа через ЕСИА (одинаков для всех пользователей, меняется только ссылка в кнопке)
+_ESIA_TEXT = "В региональной системе данные не найдены.\n\nНажмите кнопку ниже и пройдите авторизацию в ЕСИА."
+
+@lru_cache(maxsize=4096)
+def _esia_attachments(user_id: int) -> list:
+    """Вложения со ссылкой на ЕСИА: ссылка зависит только от user_id, поэтому кешируются"""
+    return _as_attachments(create_keyboard(
+        [[{'type': 'link', 'text': 'Войти через ЕСИА', 'url': generate_esia_url(user_id)}]]
+    ))
+
+
+@lru_cache(maxsize=1)
+def _adult_cutoff(today: date) -> Tuple[int, int, int]:
+    """Самая поздняя дата рождения (год, месяц, день), при которой на today уже исполнилось 18 лет.
+    Пересчитывается раз в сутки: ключ кеша - текущая дата"""
+    return (today.year - 18, today.month, today.day)
+
+
+# Файл согласия на обработку ПД: путь и вложение готовятся один раз при импорте
+_CONSENT_PATH = os.path.join(os.getcwd(), "assets", "Soglasie.txt")
+_CONSENT_MEDIA = InputMedia(path=_CONSENT_PATH) if os.path.exists(_CONSENT_PATH) else None
+
+
+@dataclass(slots=True)
+class UserRegState:
+    """Состояние пользователя в процессе регистрации"""
+    state: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    # Найденные по телефону пациенты (для возврата к выбору себя из списка)
+    candidates: Optional[list] = None
+
 
 class RegistrationHandler:
     """Обработчик процесса регистрации пользователя"""
 
-    def __init__(self, user_states: Dict[str, Any]):
+    def __init__(self, user_states: Dict[int, UserRegState],
+                 send_welcome_message: Optional[Callable] = None):
+        """
+        user_states — общий словарь состояний регистрации
+        send_welcome_message — функция из bot_handlers для показа стартового сообщения
+        (передаётся снаружи: bot_handlers сам импортирует этот модуль через bot_config)
+        """
         self.user_states = user_states
+        self.send_welcome_message = send_welcome_message
+        # Сильные ссылки на фоновые задачи (мониторинг ЕСИА), чтобы их не собрал GC до завершения
+        self._bg_tasks: Set[asyncio.Task] = set()
 
     async def send_agreement_message(self, bot_instance: Bot, user_id: int, chat_id: int):
         """Отправляет сообщение с соглашением"""
-        keyboard = create_keyboard([[
-            {'type': 'callback', 'text': 'Согласие на обработку персональных данных', 'payload': AGREEMENT_CALLBACK}
-        ]])
-
-        import os
-        consent_file_path = os.path.join(os.getcwd(), "assets", "Soglasie.txt")
-        
         attachments = []
-        if os.path.exists(consent_file_path):
-             attachments.append(InputMedia(path=consent_file_path))
-        
-        if keyboard:
-            attachments.append(keyboard)
+        if _CONSENT_MEDIA is not None:
+            attachments.append(_CONSENT_MEDIA)
+
+        if _KB_AGREEMENT:
+            attachments.append(_KB_AGREEMENT)
 
         await bot_instance.send_message(
             chat_id=chat_id,
@@ -66,64 +243,77 @@ class RegistrationHandler:
             attachments=attachments
         )
 
-    async def start_registration_process(self, bot_instance: Bot, user_id: int, chat_id: int):
-        """Начинает процесс регистрации - подтверждение телефона"""
-        self.user_states[user_id] = {'state': 'waiting_phone_confirmation', 'data': {}}
+    async def start_registration_process(self, bot_instance: Bot, user_id: int, chat_id: int,
+                                         notice: Optional[str] = None):
+        """
+        Начинает процесс регистрации - подтверждение телефона.
+        notice - сообщение о причине перезапуска, отправляется в том же сообщении
+        """
+        self.user_states[user_id] = UserRegState(STATE_WAITING_PHONE_CONFIRMATION)
         log_user_event(user_id, "registration_started")
 
-        await bot_instance.send_message(
-            chat_id=chat_id,
-            text='Для начала работы необходимо подтвердить номер и пройти регистрацию.'
+        intro = 'Для начала работы необходимо подтвердить номер и пройти регистрацию.'
+        await self.request_contact(
+            bot_instance, chat_id,
+            prefix_text=f"{notice}\n\n{intro}" if notice else intro
         )
-        await self.request_contact(bot_instance, chat_id)
-
-    async def request_contact(self, bot_instance: Bot, chat_id: int):
-        """Запрашивает контакт пользователя"""
-        keyboard = create_keyboard([[
-            {'type': 'contact', 'text': '📇 Отправить контакт'}
-        ]])
 
+    async def request_contact(self, bot_instance: Bot, chat_id: int, prefix_text: Optional[str] = None):
+        """Запрашивает контакт пользователя (prefix_text выводится в том же сообщении перед просьбой)"""
+        text = "Нажмите кнопку ниже чтобы поделиться контактом:"
+        if prefix_text:
+            text = f"{prefix_text}\n\n{text}"
         await bot_instance.send_message(
             chat_id=chat_id,
-            text="Нажмите кнопку ниже чтобы поделиться контактом:",
-            attachments=[keyboard] if keyboard else []
+            text=text,
+            attachments=_ATT_CONTACT
         )
 
     async def send_phone_confirmation(self, bot_instance: Bot, chat_id: int, phone: str):
         """Отправляет сообщение с подтверждением номера телефона"""
-        keyboard = create_keyboard([[
-            {'type': 'callback', 'text': '✅ Да, номер верный', 'payload': CONFIRM_PHONE_CALLBACK},
-            {'type': 'callback', 'text': '❌ Нет, неверный номер', 'payload': REJECT_PHONE_CALLBACK}
-        ]])
-
         await bot_instance.send_message(
             chat_id=chat_id,
             text=f"📞 Ваш номер телефона определён:\n\n📱 {phone}\n\nПожалуйста, проверьте актуальность номера:",
-            attachments=[keyboard] if keyboard else []
+            attachments=_ATT_PHONE_CONFIRM
         )
 
     async def handle_incorrect_phone(self, bot_instance: Bot, user_id: int, chat_id: int):
         """Обработка неверного номера телефона"""
         log_user_event(user_id, "phone_rejected")
-        await bot_instance.send_message(
-            chat_id=chat_id,
-            text="❌ Пожалуйста, отправьте контакт с правильным номером телефона."
+        await self.request_contact(
+            bot_instance, chat_id,
+            prefix_text="❌ Пожалуйста, отправьте контакт с правильным номером телефона."
         )
-        await self.request_contact(bot_instance, chat_id)
 
-    async def start_fio_request(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
-        """Начинает процесс ввода ФИО"""
-        self.user_states[user_id] = {'state': 'waiting_fio', 'data': user_data}
+    def _set_state(self, user_id: int, state: str, data: dict, candidates: Optional[list] = None):
+        """
+        Переводит пользователя в новое состояние, изменяя существующее состояние на месте.
+        Список кандидатов при этом сохраняется, если не передан новый.
+        """
+        current = self.user_states.get(user_id)
+        if current is None:
+            self.user_states[user_id] = UserRegState(state, data, candidates)
+            return
+        current.state = state
+        current.data = data
+        if candidates is not None:
+            current.candidates = candidates
+
+    async def start_fio_request(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict,
+                                notice: Optional[str] = None):
+        """Начинает процесс ввода ФИО (notice выводится в том же сообщении перед просьбой)"""
+        self._set_state(user_id, STATE_WAITING_FIO, user_data)
         log_user_event(user_id, "fio_input_started")
 
+        text = 'Пожалуйста, введите ваше ФИО в формате:\nФамилия Имя Отчество\n\nПример: Иванов Иван Иванович'
         await bot_instance.send_message(
             chat_id=chat_id,
-            text='Пожалуйста, введите ваше ФИО в формате:\nФамилия Имя Отчество\n\nПример: Иванов Иван Иванович'
+            text=f"{notice}\n\n{text}" if notice else text
         )
 
     async def request_birth_date(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
         """Запрашивает дату рождения"""
-        self.user_states[user_id] = {'state': 'waiting_birth_date', 'data': user_data}
+        self._set_state(user_id, STATE_WAITING_BIRTH_DATE, user_data)
 
         await bot_instance.send_message(
             chat_id=chat_id,
@@ -132,7 +322,7 @@ class RegistrationHandler:
 
     async def request_snils(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
         """Запрашивает СНИЛС"""
-        self.user_states[user_id] = {'state': 'waiting_snils', 'data': user_data}
+        self._set_state(user_id, STATE_WAITING_SNILS, user_data)
         await bot_instance.send_message(
             chat_id=chat_id,
             text="Теперь введите ваш СНИЛС (11 цифр).\nМожно с дефисами и пробелами."
@@ -140,7 +330,7 @@ class RegistrationHandler:
 
     async def request_oms(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
         """Запрашивает полис ОМС"""
-        self.user_states[user_id] = {'state': 'waiting_oms', 'data': user_data}
+        self._set_state(user_id, STATE_WAITING_OMS, user_data)
         await bot_instance.send_message(
             chat_id=chat_id,
             text="Введите номер полиса ОМС (от 10 до 20 цифр)."
@@ -148,21 +338,12 @@ class RegistrationHandler:
 
     async def request_gender(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
         """Запрашивает пол пользователя"""
-        current_state = self.user_states.get(user_id, {})
-        new_state = {'state': 'waiting_gender', 'data': user_data}
-        if 'candidates' in current_state:
-            new_state['candidates'] = current_state['candidates']
-            
-        self.user_states[user_id] = new_state
-        
-        keyboard = create_keyboard([[
-            {'type': 'callback', 'text': 'Мужской', 'payload': GENDER_MALE_CALLBACK},
-            {'type': 'callback', 'text': 'Женский', 'payload': GENDER_FEMALE_CALLBACK}
-        ]])
+        self._set_state(user_id, STATE_WAITING_GENDER, user_data)
+
         await bot_instance.send_message(
             chat_id=chat_id,
             text="Выберите ваш пол:",
-            attachments=[keyboard]
+            attachments=_ATT_GENDER
         )
 
     async def send_confirmation_message(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
@@ -178,35 +359,15 @@ class RegistrationHandler:
 
         log_data_event(user_id, "confirmation_prepared", fio=fio, birth_date=birth_date, phone=phone, is_from_rms=is_from_rms)
         
-        # Кнопки редактирования показываем только если данные НЕ из РМИС
-        buttons_config = []
-        
-        if not is_from_rms:
-            buttons_config.extend([
-                [{'type': 'callback', 'text': '⚠️ Исправить ФИО', 'payload': CORRECT_FIO_CALLBACK}],
-                [{'type': 'callback', 'text': '⚠️ Исправить дату рождения', 'payload': CORRECT_BIRTH_DATE_CALLBACK}],
-                [{'type': 'callback', 'text': '⚠️ Исправить СНИЛС', 'payload': CORRECT_SNILS_CALLBACK}],
-                [{'type': 'callback', 'text': '⚠️ Исправить ОМС', 'payload': CORRECT_OMS_CALLBACK}],
-                [{'type': 'callback', 'text': '⚠️ Исправить пол', 'payload': CORRECT_GENDER_CALLBACK}]
-            ])
-        else:
-            # Данные из РМИС - редактирование запрещено, но можно сообщить об ошибке
-            buttons_config.append([{'type': 'callback', 'text': '❌ Нашли ошибку?', 'payload': "reg_incorrect_data"}])
-            
-        buttons_config.append([{'type': 'callback', 'text': '✅ Всё верно, подтвердить', 'payload': CONFIRM_DATA_CALLBACK}])
-
-        # Если есть список кандидатов, добавляем кнопку "Назад"
-        if self.user_states.get(user_id, {}).get('candidates'):
-             buttons_config.append([{'type': 'callback', 'text': '🔙 Назад к выбору', 'payload': 'reg_back_to_list'}])
-
-        keyboard = create_keyboard(buttons_config)
+        current_state = self.user_states.get(user_id)
+        has_candidates = bool(current_state and current_state.candidates)
         
         edit_hint = "" if is_from_rms else "\nЕсли всё верно - нажмите 'Подтвердить', или выберите что нужно исправить:"
 
         await bot_instance.send_message(
             chat_id=chat_id,
             text=f"📋 Пожалуйста, проверьте личные данные:\n\n👤 ФИО: {fio}\n🎂 Дата рождения: {birth_date}\n📞 Телефон: {phone}\n💳 СНИЛС: {snils}\n🏥 ОМС: {oms}\n⚧ Пол: {gender}{edit_hint}",
-            attachments=[keyboard] if keyboard else []
+            attachments=_ATT_CONFIRMATION[bool(is_from_rms), has_candidates]
         )
 
     async def complete_registration(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
@@ -221,12 +382,15 @@ class RegistrationHandler:
         # Вариант A: уже зарегистрированный — обновляем данные вместо INSERT
         if db.is_user_registered(user_id):
             try:
-                async with asyncio.timeout(10):
-                    success = db.update_user_data(user_id, fio, birth_date, snils, oms, gender)
-                    if success:
-                        db.update_last_chat_id(user_id, chat_id)
+                async with _DB_SEM:
+                    async with asyncio.timeout(10):
+                        success = await run_db(db.update_user_data, user_id, fio, birth_date, snils, oms, gender)
+                        if success:
+                            await run_db(db.update_last_chat_id, user_id, chat_id)
             except asyncio.TimeoutError:
-                log_system_event("db_timeout", user_id=user_id)
+                # Таймаут отменяет только ожидание: запрос в потоке продолжает выполняться
+                # и может всё же закоммитить данные
+                log_system_event("database", "db_timeout", user_id=user_id)
                 await bot_instance.send_message(
                     chat_id=chat_id,
                     text="⏳ Сервер перегружен, попробуйте позже"
@@ -234,10 +398,13 @@ class RegistrationHandler:
                 return
         else:
             try:
-                async with asyncio.timeout(10):
-                    success = db.register_user(user_id, chat_id, fio, phone, birth_date, snils, oms, gender)
+                async with _DB_SEM:
+                    async with asyncio.timeout(10):
+                        success = await run_db(db.register_user, user_id, chat_id, fio, phone, birth_date, snils, oms, gender)
             except asyncio.TimeoutError:
-                log_system_event("db_timeout", user_id=user_id)
+                # Таймаут отменяет только ожидание: запрос в потоке продолжает выполняться
+                # и может всё же закоммитить данные
+                log_system_event("database", "db_timeout", user_id=user_id)
                 await bot_instance.send_message(
                     chat_id=chat_id,
                     text="⏳ Сервер перегружен, попробуйте позже"
@@ -266,30 +433,13 @@ class RegistrationHandler:
     async def validate_and_process_input(self, user_id: int, input_text: str, input_type: str,
                                          bot_instance: Bot, chat_id: int, user_data: dict):
         """Универсальная функция валидации и обработки ввода для регистрации"""
-        validator_map = {
-            'fio': db.validate_fio,
-            'birth_date': db.validate_birth_date,
-            'phone': db.validate_phone,
-            'snils': db.validate_snils,
-            'oms': db.validate_oms,
-            'gender': db.validate_gender
-        }
-
-        error_messages = {
-            'fio': "❌ Ошибка формата!\n\nПожалуйста, введите ваше ФИО в формате: Фамилия Имя Отчество\n\nПример: Иванов Иван Иванович",
-            'birth_date': "❌ Ошибка формата!\n\nПожалуйста, введите дату рождения в формате: ДД.ММ.ГГГГ\n\nПример: 13.03.2003",
-            'phone': "❌ Неверный формат номера телефона.",
-            'snils': "❌ Неверный формат СНИЛС (нужно 11 цифр).",
-            'oms': "❌ Неверный формат ОМС (должен содержать от 10 до 20 цифр).",
-            'gender': "❌ Неверный формат пола."
-        }
-
-        if input_type not in validator_map:
+        validator = _VALIDATORS.get(input_type)
+        if validator is None:
             return False
 
-        if not validator_map[input_type](input_text):
+        if not validator(input_text):
             log_user_event(user_id, f"invalid_{input_type}_format", input=input_text)
-            await bot_instance.send_message(chat_id=chat_id, text=error_messages[input_type])
+            await bot_instance.send_message(chat_id=chat_id, text=_VALIDATION_ERRORS[input_type])
             return False
 
         # Сохраняем данные
@@ -299,81 +449,54 @@ class RegistrationHandler:
 
     async def request_data_correction(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict, data_type: str):
         """Универсальная функция запроса исправления данных"""
-        correction_configs = {
-            'fio': {
-                'state': 'waiting_fio_correction',
-                'log_event': 'fio_correction_requested',
-                'message': "Введите ваше ФИО для исправления:\n\nФормат: Фамилия Имя Отчество\nПример: Иванов Иван Иванович"
-            },
-            'birth_date': {
-                'state': 'waiting_birth_date_correction',
-                'log_event': 'birth_date_correction_requested',
-                'message': "Введите вашу дату рождения для исправления:\n\nФормат: ДД.ММ.ГГГГ\nПример: 13.03.2003"
-            },
-            'snils': {
-                'state': 'waiting_snils_correction',
-                'log_event': 'snils_correction_requested',
-                'message': "Введите ваш СНИЛС для исправления (11 цифр)."
-            },
-            'oms': {
-                'state': 'waiting_oms_correction',
-                'log_event': 'oms_correction_requested',
-                'message': "Введите ваш полис ОМС для исправления (от 10 до 20 цифр)."
-            },
-            'gender': {
-                'state': 'waiting_gender_correction',
-                'log_event': 'gender_correction_requested',
-                'message': "Выберите ваш пол для исправления:"
-            }
-        }
-
-        if data_type not in correction_configs:
+        config = _CORRECTION_CONFIGS.get(data_type)
+        if config is None:
             return
 
-        config = correction_configs[data_type]
-        self.user_states[user_id] = {'state': config['state'], 'data': user_data}
+        self._set_state(user_id, config['state'], user_data)
         log_user_event(user_id, config['log_event'])
 
-        attachments = []
-        if data_type == 'gender':
-            keyboard = create_keyboard([[
-                {'type': 'callback', 'text': 'Мужской', 'payload': GENDER_MALE_CALLBACK},
-                {'type': 'callback', 'text': 'Женский', 'payload': GENDER_FEMALE_CALLBACK}
-            ]])
-            if keyboard:
-                attachments.append(keyboard)
-
+        attachments = _ATT_GENDER if data_type == 'gender' else []
         await bot_instance.send_message(chat_id=chat_id, text=config['message'], attachments=attachments)
 
-    def _is_adult(self, birth_date_str: str) -> bool:
-        """Проверяет, есть ли пользователю 18 лет. Формат: ДД.ММ.ГГГГ"""
+    def _is_adult(self, birth_date_str: str, cutoff: Optional[Tuple[int, int, int]] = None) -> bool:
+        """
+        Проверяет, есть ли пользователю 18 лет. Формат: ДД.ММ.ГГГГ
+        cutoff - граница совершеннолетия (год, месяц, день), см. _adult_cutoff
+        """
         try:
-            birth_date = datetime.strptime(birth_date_str, "%d.%m.%Y")
-            today = datetime.now()
-            age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
-            return age >= 18
-        except ValueError:
+            day, month, year = birth_date_str.split('.')
+            # date() отклоняет несуществующие даты (например, 31.02.2000)
+            birth = date(int(year), int(month), int(day))
+        except (ValueError, AttributeError):
             return False
+        if cutoff is None:
+            cutoff = _adult_cutoff(date.today())
+        return (birth.year, birth.month, birth.day) <= cutoff
 
     async def handle_phone_confirmation(self, bot_instance: Bot, user_id: int, chat_id: int):
         """Обработка подтверждения телефона"""
         log_user_event(user_id, "phone_confirmed")
-        current_state = self.user_states.get(user_id, {})
-        user_data = current_state.get('data', {})
+        current_state = self.user_states.get(user_id)
+        user_data = current_state.data if current_state else {}
 
         if 'phone' not in user_data:
             log_data_event(user_id, "phone_missing_on_confirmation")
-            await bot_instance.send_message(chat_id=chat_id,
-                                            text="❌ Ошибка: номер телефона не найден. Начинаем регистрацию заново.")
-            await self.start_registration_process(bot_instance, user_id, chat_id)
+            await self.start_registration_process(
+                bot_instance, user_id, chat_id,
+                notice="❌ Ошибка: номер телефона не найден. Начинаем регистрацию заново."
+            )
             return
 
-        # ⚡ ЗАПРОС К API ПАЦИЕНТОВ ⚡
-        await bot_instance.send_message(chat_id=chat_id, text="🔄 Проверяем данные в Рег. системе...")
-        found_patients = await get_patients_by_phone(user_data['phone'])
+        # ⚡ ЗАПРОС К API ПАЦИЕНТОВ ⚡ (параллельно с уведомлением пользователя)
+        _, found_patients = await asyncio.gather(
+            bot_instance.send_message(chat_id=chat_id, text="🔄 Проверяем данные в Рег. системе..."),
+            get_patients_by_phone(user_data['phone'])
+        )
         
         # Фильтрация несовершеннолетних
-        adult_patients = [p for p in found_patients if self._is_adult(p.get('birth_date', ''))]
+        cutoff = _adult_cutoff(date.today())
+        adult_patients = [p for p in found_patients if self._is_adult(p.get('birth_date', ''), cutoff)]
         
         if not adult_patients:
             # Если ничего не нашли (или все несовершеннолетние) — предлагаем ЕСИА
@@ -393,45 +516,43 @@ class RegistrationHandler:
             # Устанавливаем стейт (без candidates, т.к. выбор был безальтернативный)
             # Если пол есть - сразу к подтверждению, иначе запрашиваем
             if user_data.get('gender'):
-                 self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
+                 self._set_state(user_id, STATE_WAITING_CONFIRMATION, user_data)
                  log_data_event(user_id, "identity_autoselected_single", snils=user_data['snils'], gender_autofilled=True)
                  await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
             else:
-                 self.user_states[user_id] = {'state': 'waiting_gender', 'data': user_data}
+                 self._set_state(user_id, STATE_WAITING_GENDER, user_data)
                  log_data_event(user_id, "identity_autoselected_single", snils=user_data['snils'])
                  await self.request_gender(bot_instance, user_id, chat_id, user_data)
             return
 
         # Если нашли взрослых (>1) — предлагаем выбрать
-        self.user_states[user_id] = {'state': 'waiting_identity_selection', 'data': user_data, 'candidates': adult_patients}
-        
-        keyboard_rows = []
-        for idx, p in enumerate(adult_patients):
-            btn_text = f"{p['fio']} ({p['birth_date']})"
-            keyboard_rows.append([{'type': 'callback', 'text': btn_text, 'payload': f"reg_identity_{idx}"}])
-        
-        # Ручной ввод убран по требованию
-        
-        keyboard = create_keyboard(keyboard_rows)
+        self._set_state(user_id, STATE_WAITING_IDENTITY_SELECTION, user_data, candidates=adult_patients)
         
         await bot_instance.send_message(
             chat_id=chat_id,
-            #text="🔍 По вашему номеру найдены следующие пациенты.\nКто вы?",
-            text="🔍 На ваш номер зарегистрировано несколько медицинских карт.\nЧтобы пройти регистрацию выберете себя!",
-            attachments=[keyboard]
+            text=_IDENTITY_PROMPT,
+            attachments=[self._build_candidates_keyboard(adult_patients)]
         )
 
+    def _build_candidates_keyboard(self, candidates: list):
+        """Клавиатура выбора себя из найденных по телефону пациентов (ручной ввод убран по требованию)"""
+        return create_keyboard([
+            [{'type': 'callback', 'text': f"{p['fio']} ({p['birth_date']})", 'payload': f"reg_identity_{idx}"}]
+            for idx, p in enumerate(candidates)
+        ])
+
     async def handle_data_correction(self, bot_instance: Bot, user_id: int, chat_id: int, data_type: str):
         """Обработка исправления данных"""
-        current_data = self.user_states.get(user_id, {}).get('data', {})
+        current_state = self.user_states.get(user_id)
+        current_data = current_state.data if current_state else {}
         current_data.pop(data_type, None)
         await self.request_data_correction(bot_instance, user_id, chat_id, current_data, data_type)
 
     async def handle_identity_selection(self, bot_instance: Bot, user_id: int, chat_id: int, selection_idx: str):
         """Обработка выбора личности из списка API"""
-        current_state = self.user_states.get(user_id, {})
-        user_data = current_state.get('data', {})
-        candidates = current_state.get('candidates', [])
+        current_state = self.user_states.get(user_id)
+        user_data = current_state.data if current_state else {}
+        candidates = (current_state.candidates if current_state else None) or _NO_CANDIDATES
 
         if selection_idx == 'manual':
             user_data['is_from_rms'] = False
@@ -442,9 +563,9 @@ class RegistrationHandler:
             idx = int(selection_idx)
             selected_patient = candidates[idx]
         except (ValueError, IndexError):
-            await bot_instance.send_message(chat_id=chat_id, text="⚠ Ошибка выбора. Пробуем вручную.")
             user_data['is_from_rms'] = False
-            await self.start_fio_request(bot_instance, user_id, chat_id, user_data)
+            await self.start_fio_request(bot_instance, user_id, chat_id, user_data,
+                                         notice="⚠ Ошибка выбора. Пробуем вручную.")
             return
 
         # Автозаполнение данных
@@ -457,116 +578,101 @@ class RegistrationHandler:
 
         if user_data.get('gender'):
             # Пол есть - сразу к подтверждению
-            self.user_states[user_id] = {
-                'state': 'waiting_confirmation',
-                'data': user_data,
-                'candidates': candidates 
-            }
+            self._set_state(user_id, STATE_WAITING_CONFIRMATION, user_data)
             log_data_event(user_id, "identity_autofilled", snils=user_data['snils'], gender_autofilled=True)
             await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
         else:
              # Пола нет - запрашиваем
-            self.user_states[user_id] = {
-                'state': 'waiting_gender',
-                'data': user_data,
-                'candidates': candidates 
-            }
+            self._set_state(user_id, STATE_WAITING_GENDER, user_data)
             log_data_event(user_id, "identity_autofilled", snils=user_data['snils'])
             await self.request_gender(bot_instance, user_id, chat_id, user_data)
  
     async def handle_back_to_list(self, bot_instance: Bot, user_id: int, chat_id: int):
         """Возврат к экрану выбора личности"""
-        current_state = self.user_states.get(user_id, {})
-        candidates = current_state.get('candidates', [])
-        user_data = current_state.get('data', {})
+        current_state = self.user_states.get(user_id)
+        candidates = current_state.candidates if current_state else None
+        user_data = current_state.data if current_state else {}
 
         if not candidates:
             # Если кандидатов нет в стейте, значит что-то пошло не так
             await self.start_registration_process(bot_instance, user_id, chat_id)
             return
 
-        self.user_states[user_id] = {'state': 'waiting_identity_selection', 'data': user_data, 'candidates': candidates}
-
-        keyboard_rows = []
-        for idx, p in enumerate(candidates):
-            btn_text = f"{p['fio']} ({p['birth_date']})"
-            keyboard_rows.append([{'type': 'callback', 'text': btn_text, 'payload': f"reg_identity_{idx}"}])
-        
-        # Ручной ввод убран по требованию
-        
-        keyboard = create_keyboard(keyboard_rows)
+        self._set_state(user_id, STATE_WAITING_IDENTITY_SELECTION, user_data, candidates=candidates)
 
         await bot_instance.send_message(
             chat_id=chat_id,
-            text="🔍 На ваш номер зарегистрировано несколько медицинских карт.\nЧтобы пройти регистрацию выберете себя!",
-            attachments=[keyboard]
+            text=_IDENTITY_PROMPT,
+            attachments=[self._build_candidates_keyboard(candidates)]
         )
 
     async def handle_data_confirmation(self, bot_instance: Bot, user_id: int, chat_id: int):
         """Обработка подтверждения данных"""
         log_user_event(user_id, "user_confirmed_registration")
-        user_data = self.user_states.get(user_id, {}).get('data', {})
-        required_keys = ['fio', 'birth_date', 'phone', 'snils', 'oms', 'gender']
+        current_state = self.user_states.get(user_id)
+        user_data = current_state.data if current_state else {}
+        missing_fields = _REQUIRED_FIELDS - user_data.keys()
 
         # Вариант B: уже зарегистрированный пользователь с пустыми/неполными данными — сразу главное меню
-        if db.is_user_registered(user_id) and (not user_data or not all(key in user_data for key in required_keys)):
+        if db.is_user_registered(user_id) and (not user_data or missing_fields):
             self.user_states.pop(user_id, None)
             return db.get_user_greeting(user_id)
 
-        if user_data and all(key in user_data for key in required_keys):
+        if user_data and not missing_fields:
             return await self.complete_registration(bot_instance, user_id, chat_id, user_data)
         else:
-            missing_fields = [key for key in required_keys if key not in user_data]
-            log_data_event(user_id, "incomplete_data_on_confirmation", missing=missing_fields)
-            await bot_instance.send_message(chat_id=chat_id,
-                                            text="❌ Не все данные заполнены. Начинаем регистрацию заново.")
-            await self.start_registration_process(bot_instance, user_id, chat_id)
+            log_data_event(user_id, "incomplete_data_on_confirmation", missing=sorted(missing_fields))
+            await self.start_registration_process(
+                bot_instance, user_id, chat_id,
+                notice="❌ Не все данные заполнены. Начинаем регистрацию заново."
+            )
             return None
 
     async def process_contact_message(self, event, user_id: int, chat_id: int):
         """Обработка сообщений с контактами для регистрации"""
         state_info = self.user_states.get(user_id)
-        if not state_info or state_info.get('state') != 'waiting_phone_confirmation':
+        if not state_info or state_info.state != STATE_WAITING_PHONE_CONFIRMATION:
             return False
 
-        contact_attachments = [attr for attr in event.message.body.attachments if attr.type == "contact"]
-        if not contact_attachments:
+        # Обрабатывается только первый контакт из вложений
+        contact = next((attr for attr in event.message.body.attachments if attr.type == "contact"), None)
+        if contact is None:
             return False
 
-        for contact in contact_attachments:
-            try:
-                payload = contact.payload
-                vcf_info = payload.vcf_info
-                phone_match = re.search(r'TEL[^:]*:([^\r\n]+)', vcf_info)
-
-                if phone_match:
-                    phone = phone_match.group(1).strip()
-                    clean_phone = re.sub(r'[^\d+]', '', phone)
-                    if not clean_phone.startswith('+'):
-                        clean_phone = '+' + clean_phone
-                    if not db.validate_phone(clean_phone):
-                        log_user_event(user_id, "invalid_phone_format", phone=clean_phone)
-                        await event.bot.send_message(chat_id=chat_id, text="❌ Неверный формат номера телефона.")
-                        return True
-
-                    user_data = state_info.get('data', {})
-                    user_data['phone'] = clean_phone
-                    self.user_states[user_id] = {'state': 'waiting_phone_confirmation', 'data': user_data}
-
-                    log_data_event(user_id, "phone_extracted", phone=clean_phone)
-                    await self.send_phone_confirmation(event.bot, chat_id, clean_phone)
-                    return True
-                else:
-                    log_user_event(user_id, "phone_extraction_failed")
-                    await event.bot.send_message(chat_id=chat_id, text="❌ Не удалось определить номер телефона.")
+        try:
+            payload = contact.payload
+            vcf_info = payload.vcf_info
+            phone_match = _TEL_RE.search(vcf_info)
+
+            if phone_match:
+                phone = phone_match.group(1).strip()
+                clean_phone = phone.translate(_PHONE_KEEP)
+                if not clean_phone.isascii():
+                    # Редкий случай: юникодные пробелы/тире в номере - дочищаем регулярным выражением
+                    clean_phone = _NON_PHONE_CHARS_RE.sub('', clean_phone)
+                if not clean_phone.startswith('+'):
+                    clean_phone = '+' + clean_phone
+                if not db.validate_phone(clean_phone):
+                    log_user_event(user_id, "invalid_phone_format", phone=clean_phone)
+                    await event.bot.send_message(chat_id=chat_id, text="❌ Неверный формат номера телефона.")
                     return True
 
-            except Exception as e:
-                log_system_event("contact_handler", "processing_failed", error=str(e), user_id=user_id)
-                await event.bot.send_message(chat_id=chat_id, text="❌ Произошла ошибка при обработке контакта.")
+                user_data = state_info.data
+                user_data['phone'] = clean_phone
+                self._set_state(user_id, STATE_WAITING_PHONE_CONFIRMATION, user_data)
+
+                log_data_event(user_id, "phone_extracted", phone=clean_phone)
+                await self.send_phone_confirmation(event.bot, chat_id, clean_phone)
+                return True
+            else:
+                log_user_event(user_id, "phone_extraction_failed")
+                await event.bot.send_message(chat_id=chat_id, text="❌ Не удалось определить номер телефона.")
                 return True
 
-        return False
+        except Exception as e:
+            log_system_event("contact_handler", "processing_failed", error=str(e), user_id=user_id)
+            await event.bot.send_message(chat_id=chat_id, text="❌ Произошла ошибка при обработке контакта.")
+            return True
 
     async def process_text_input(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int):
         """Обработка текстового ввода в процессе регистрации"""
@@ -574,35 +680,16 @@ class RegistrationHandler:
         if not state_info:
             return False
 
-        state = state_info.get('state')
-        user_data = state_info.get('data', {})
+        state = state_info.state
+        user_data = state_info.data
 
         # Обработка разных состояний регистрации
-        state_handlers = {
-            'waiting_fio': lambda: self._handle_fio_input(user_id, message_text, bot_instance, chat_id, user_data),
-            'waiting_birth_date': lambda: self._handle_birth_date_input(user_id, message_text, bot_instance,
-                                                                        chat_id, user_data),
-            'waiting_snils': lambda: self._handle_snils_input(user_id, message_text, bot_instance, chat_id, user_data),
-            'waiting_oms': lambda: self._handle_oms_input(user_id, message_text, bot_instance, chat_id, user_data),
-            'waiting_gender': lambda: self._handle_gender_input(user_id, message_text, bot_instance, chat_id, user_data),
-            'waiting_fio_correction': lambda: self._handle_fio_correction(user_id, message_text, bot_instance,
-                                                                          chat_id, user_data),
-            'waiting_birth_date_correction': lambda: self._handle_birth_date_correction(user_id, message_text,
-                                                                                        bot_instance, chat_id,
-                                                                                        user_data),
-            'waiting_snils_correction': lambda: self._handle_snils_correction(user_id, message_text, bot_instance,
-                                                                              chat_id, user_data),
-            'waiting_oms_correction': lambda: self._handle_oms_correction(user_id, message_text, bot_instance,
-                                                                          chat_id, user_data),
-            'waiting_gender_correction': lambda: self._handle_gender_correction(user_id, message_text, bot_instance,
-                                                                                chat_id, user_data),
-        }
-
-        if state in state_handlers:
-            result = await state_handlers[state]()
-            return result is not False  # Возвращаем True если состояние обработано
-
-        return False
+        handler = self._STATE_HANDLERS.get(state)
+        if handler is None:
+            return False
+
+        result = await handler(self, user_id, message_text, bot_instance, chat_id, user_data)
+        return result is not False  # Возвращаем True если состояние обработано
 
     async def _handle_fio_input(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
                                 user_data: dict):
@@ -637,43 +724,28 @@ class RegistrationHandler:
         success = await self.validate_and_process_input(user_id, message_text, 'gender', bot_instance, chat_id,
                                                         user_data)
         if success:
-            current_state = self.user_states.get(user_id, {})
-            new_state = {'state': 'waiting_confirmation', 'data': user_data}
-            if 'candidates' in current_state:
-                new_state['candidates'] = current_state['candidates']
-
-            self.user_states[user_id] = new_state
+            self._set_state(user_id, STATE_WAITING_CONFIRMATION, user_data)
             await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
         return success
 
     async def handle_gender_choice(self, bot_instance: Bot, user_id: int, chat_id: int, gender: str):
         """Обработка выбора пола через кнопки"""
-        current_state = self.user_states.get(user_id, {})
-        user_data = current_state.get('data', {})
+        current_state = self.user_states.get(user_id)
+        user_data = current_state.data if current_state else {}
         
         # Валидация и сохранение
-        if gender not in ["Мужской", "Женский"]:
+        if gender not in _VALID_GENDERS:
             return False
             
         user_data['gender'] = gender
         log_data_event(user_id, "gender_selected", gender=gender)
         
-        # Если это была коррекция — возвращаемся к подтверждению
-        if current_state.get('state') == 'waiting_gender_correction':
-             self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
-             await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
-             return True
-             
-        # Если обычный флоу регистрации — переходим к подтверждению
-        next_state = {
-            'state': 'waiting_confirmation',
-            'data': user_data,
-        }
-        # Пробрасываем кандидатов, если они были
-        if 'candidates' in current_state:
-            next_state['candidates'] = current_state['candidates']
-
-        self.user_states[user_id] = next_state
+        # И после коррекции, и в обычном флоу регистрации переходим к подтверждению
+        # (кандидаты сохраняются в состоянии; уже полученное состояние меняем на месте)
+        if current_state is not None:
+            current_state.state = STATE_WAITING_CONFIRMATION
+        else:
+            self._set_state(user_id, STATE_WAITING_CONFIRMATION, user_data)
         await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
         return True
 
@@ -693,55 +765,30 @@ class RegistrationHandler:
             await self.request_snils(bot_instance, user_id, chat_id, user_data)
         return success
 
-    async def _handle_fio_correction(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
-                                     user_data: dict):
-        """Обработка исправления ФИО"""
-        success = await self.validate_and_process_input(user_id, message_text, 'fio', bot_instance, chat_id,
+    async def _handle_field_correction(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
+                                       user_data: dict, field: str):
+        """Обработка исправления поля field (ФИО, дата рождения, СНИЛС, ОМС, пол) - возврат к подтверждению"""
+        success = await self.validate_and_process_input(user_id, message_text, field, bot_instance, chat_id,
                                                         user_data)
         if success:
-            self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
+            self._set_state(user_id, STATE_WAITING_CONFIRMATION, user_data)
             await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
         return success
 
-    async def _handle_birth_date_correction(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
-                                            user_data: dict):
-        """Обработка исправления даты рождения"""
-        success = await self.validate_and_process_input(user_id, message_text, 'birth_date', bot_instance, chat_id,
-                                                        user_data)
-        if success:
-            self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
-            await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
-        return success
-
-    async def _handle_snils_correction(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
-                                       user_data: dict):
-        """Обработка исправления СНИЛС"""
-        success = await self.validate_and_process_input(user_id, message_text, 'snils', bot_instance, chat_id,
-                                                        user_data)
-        if success:
-            self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
-            await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
-        return success
-
-    async def _handle_oms_correction(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
-                                     user_data: dict):
-        """Обработка исправления ОМС"""
-        success = await self.validate_and_process_input(user_id, message_text, 'oms', bot_instance, chat_id,
-                                                        user_data)
-        if success:
-            self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
-            await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
-        return success
-
-    async def _handle_gender_correction(self, user_id: int, message_text: str, bot_instance: Bot, chat_id: int,
-                                        user_data: dict):
-        """Обработка исправления пола (текст)"""
-        success = await self.validate_and_process_input(user_id, message_text, 'gender', bot_instance, chat_id,
-                                                        user_data)
-        if success:
-            self.user_states[user_id] = {'state': 'waiting_confirmation', 'data': user_data}
-            await self.send_confirmation_message(bot_instance, user_id, chat_id, user_data)
-        return success
+    # Обработчики текстового ввода по состояниям регистрации (несвязанные методы, строятся один раз)
+    _STATE_HANDLERS = {
+        STATE_WAITING_FIO: _handle_fio_input,
+        STATE_WAITING_BIRTH_DATE: _handle_birth_date_input,
+        STATE_WAITING_SNILS: _handle_snils_input,
+        STATE_WAITING_OMS: _handle_oms_input,
+        STATE_WAITING_GENDER: _handle_gender_input,
+        # Исправления всех полей обрабатываются одной корутиной
+        STATE_WAITING_FIO_CORRECTION: partial(_handle_field_correction, field='fio'),
+        STATE_WAITING_BIRTH_DATE_CORRECTION: partial(_handle_field_correction, field='birth_date'),
+        STATE_WAITING_SNILS_CORRECTION: partial(_handle_field_correction, field='snils'),
+        STATE_WAITING_OMS_CORRECTION: partial(_handle_field_correction, field='oms'),
+        STATE_WAITING_GENDER_CORRECTION: partial(_handle_field_correction, field='gender'),
+    }
 
     async def show_esia_option(self, bot_instance: Bot, user_id: int, chat_id: int, user_data: dict):
         """
@@ -750,27 +797,24 @@ class RegistrationHandler:
         """
         log_user_event(user_id, "esia_option_shown")
         
-        esia_url = generate_esia_url(user_id)
-        keyboard = create_keyboard([[{'type': 'link', 'text': 'Войти через ЕСИА', 'url': esia_url}]])
         await bot_instance.send_message(
             chat_id=chat_id,
-            text="В региональной системе данные не найдены.\n\nНажмите кнопку ниже и пройдите авторизацию в ЕСИА.",
-            attachments=[keyboard] if keyboard else []
+            text=_ESIA_TEXT,
+            attachments=_esia_attachments(user_id)
         )
         
-        self.user_states[user_id] = {
-            'state': 'waiting_esia',
-            'data': user_data
-        }
-        asyncio.create_task(self.monitor_esia_file(bot_instance, user_id, chat_id))
+        self._set_state(user_id, STATE_WAITING_ESIA, user_data)
+        task = asyncio.create_task(self.monitor_esia_file(bot_instance, user_id, chat_id))
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
 
     async def handle_esia_check(self, bot_instance: Bot, user_id: int, chat_id: int):
         """
         Вызывается только при нажатии «Я прошёл авторизацию в ЕСИА».
         Запускает мониторинг файла ЕСИА только в этом случае.
         """
-        state_info = self.user_states.get(user_id, {})
-        if state_info.get('state') != 'waiting_esia':
+        state_info = self.user_states.get(user_id)
+        if not state_info or state_info.state != STATE_WAITING_ESIA:
             await bot_instance.send_message(
                 chat_id=chat_id,
                 text="Сначала нажмите «Войти через ЕСИА», пройдите авторизацию, затем нажмите «Я прошёл авторизацию в ЕСИА»."
@@ -807,8 +851,7 @@ class RegistrationHandler:
             )
             
             # Показываем стартовое сообщение
-            from bot_handlers import send_welcome_message
-            await send_welcome_message(bot_instance, chat_id)
+            await self.send_welcome_message(bot_instance, chat_id)
             
             # Очищаем состояние
             self.user_states.pop(user_id, None)
@@ -816,9 +859,11 @@ class RegistrationHandler:
         
         # Файл найден, парсим данные (телефон из регистрации — на случай null в файле)
         log_user_event(user_id, "esia_file_received", file_path=file_path)
-        user_data = (self.user_states.get(user_id) or {}).get('data', {})
+        current_state = self.user_states.get(user_id)
+        user_data = current_state.data if current_state else {}
         fallback_phone = user_data.get('phone')
-        data = parse_esia_file(file_path, fallback_phone=fallback_phone)
+        # Чтение файла и запись в БД - блокирующие операции, выполняем их в пуле потоков
+        data = await asyncio.to_thread(parse_esia_file, file_path, fallback_phone=fallback_phone)
         
         if not data:
             # Ошибка парсинга файла
@@ -829,8 +874,7 @@ class RegistrationHandler:
             )
             
             # Показываем стартовое сообщение
-            from bot_handlers import send_welcome_message
-            await send_welcome_message(bot_instance, chat_id)
+            await self.send_welcome_message(bot_instance, chat_id)
             
             # Очищаем состояние
             self.user_states.pop(user_id, None)
@@ -845,11 +889,10 @@ class RegistrationHandler:
             )
             
             # Удаляем файл для несовершеннолетних пользователей
-            delete_esia_file(file_path)
+            await asyncio.to_thread(delete_esia_file, file_path)
             
             # Показываем стартовое сообщение
-            from bot_handlers import send_welcome_message
-            await send_welcome_message(bot_instance, chat_id)
+            await self.send_welcome_message(bot_instance, chat_id)
             
             # Очищаем состояние
             self.user_states.pop(user_id, None)
@@ -857,7 +900,7 @@ class RegistrationHandler:
         
         # Сохраняем данные в БД
         log_user_event(user_id, "esia_data_saving_attempt")
-        success = save_esia_data_to_db(user_id, chat_id, data)
+        success = await run_db(save_esia_data_to_db, user_id, chat_id, data)
         
         if not success:
             # Ошибка сохранения в БД
@@ -868,22 +911,21 @@ class RegistrationHandler:
             )
             
             # Показываем стартовое сообщение
-            from bot_handlers import send_welcome_message
-            await send_welcome_message(bot_instance, chat_id)
+            await self.send_welcome_message(bot_instance, chat_id)
             
             # Очищаем состояние
             self.user_states.pop(user_id, None)
             return
         
         # Удаляем файл после успешной обработки
-        delete_esia_file(file_path)
+        await asyncio.to_thread(delete_esia_file, file_path)
         
         # Регистрация успешна
         log_user_event(user_id, "esia_registration_completed")
         self.user_states.pop(user_id, None)
         
         # Получаем имя для приветствия
-        greeting_name = db.get_user_greeting(user_id)
+        greeting_name = await run_db(db.get_user_greeting, user_id)
         
         await bot_instance.send_message(
             chat_id=chat_id,
@@ -891,7 +933,6 @@ class RegistrationHandler:
         )
         
         # Показываем главное меню
-        from bot_utils import send_main_menu
         await send_main_menu(bot_instance, chat_id, greeting_name)
 
     async def handle_incorrect_data_info(self, bot_instance: Bot, chat_id: int):
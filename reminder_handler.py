@@ -2,9 +2,18 @@
 # =======================
 # Обработчик управления напоминаниями "Вкл/Откл напоминаний"
 
+import asyncio
+import time
+
 from maxapi.types import CallbackButton, ButtonsPayload, Attachment
 from maxapi.utils.inline_keyboard import AttachmentType
 
+from user_database import run_db
+
+# Кеш статуса напоминаний (ограничен по времени жизни и размеру, как кеш приветствий в user_database)
+REMINDER_STATUS_CACHE_TTL_SEC = 600
+REMINDER_STATUS_CACHE_MAX_SIZE = 50000
+
 
 class ReminderHandler:
     def __init__(self, db, send_other_options_menu):
@@ -14,6 +23,17 @@ class ReminderHandler:
         """
         self.db = db
         self.send_other_options_menu = send_other_options_menu
+        # Клавиатура постоянная — собираем один раз
+        self._reminders_kb = self._create_reminders_keyboard()
+        # Кеш статуса напоминаний: user_id -> (момент истечения по time.monotonic(), включены ли).
+        # Статус меняется только через этот обработчик, поэтому кеш обновляется после успешной записи в БД
+        self._status_cache = {}
+
+    def _remember_status(self, user_id, status):
+        """Запоминает статус в кеше, вытесняя самую старую запись при переполнении"""
+        if len(self._status_cache) >= REMINDER_STATUS_CACHE_MAX_SIZE:
+            self._status_cache.pop(next(iter(self._status_cache)), None)
+        self._status_cache[user_id] = (time.monotonic() + REMINDER_STATUS_CACHE_TTL_SEC, status)
 
     # ---------------------------------------------------------------------
     # 🔘 Клавиатура настроек напоминаний
@@ -36,7 +56,14 @@ class ReminderHandler:
         Показывает состояние уведомлений и кнопки:
         Да / Нет / Назад
         """
-        status = self.db.get_reminders_status(user_id)
+        cached = self._status_cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            status = cached[1]
+        else:
+            status, from_table = await run_db(self.db.fetch_reminders_status, user_id)
+            # Значение по умолчанию (ошибка БД, нет записи) не кешируем
+            if from_table:
+                self._remember_status(user_id, status)
         status_text = "ВКЛЮЧЕНЫ" if status else "ОТКЛЮЧЕНЫ"
 
         text = (
@@ -47,19 +74,25 @@ class ReminderHandler:
         await bot.send_message(
             chat_id=chat_id,
             text=text,
-            attachments=[self._create_reminders_keyboard()]
+            attachments=[self._reminders_kb]
         )
 
     # ---------------------------------------------------------------------
     # ✔ Кнопка "Да" — включение напоминаний
     # ---------------------------------------------------------------------
     async def enable_reminders(self, bot, user_id, chat_id):
-        self.db.set_reminders_status(user_id, True)
-
-        await bot.send_message(
-            chat_id=chat_id,
-            text="🔔 Уведомления включены."
+        # Запись в БД (в пуле потоков) и подтверждение пользователю идут параллельно.
+        # Кеш сбрасываем заранее и заполняем только после успешной записи
+        self._status_cache.pop(user_id, None)
+        stored, _ = await asyncio.gather(
+            run_db(self.db.set_reminders_status, user_id, True),
+            bot.send_message(
+                chat_id=chat_id,
+                text="🔔 Уведомления включены."
+            )
         )
+        if stored:
+            self._remember_status(user_id, True)
 
         # Возврат в меню "Другие возможности"
         await self.send_other_options_menu(bot, chat_id)
@@ -68,12 +101,18 @@ class ReminderHandler:
     # ❌ Кнопка "Нет" — отключение напоминаний
     # ---------------------------------------------------------------------
     async def disable_reminders(self, bot, user_id, chat_id):
-        self.db.set_reminders_status(user_id, False)
-
-        await bot.send_message(
-            chat_id=chat_id,
-            text="🔕 Уведомления отключены."
+        # Запись в БД (в пуле потоков) и подтверждение пользователю идут параллельно.
+        # Кеш сбрасываем заранее и заполняем только после успешной записи
+        self._status_cache.pop(user_id, None)
+        stored, _ = await asyncio.gather(
+            run_db(self.db.set_reminders_status, user_id, False),
+            bot.send_message(
+                chat_id=chat_id,
+                text="🔕 Уведомления отключены."
+            )
         )
+        if stored:
+            self._remember_status(user_id, False)
 
         # Возврат в меню "Другие возможности"
         await self.send_other_options_menu(bot, chat_id)
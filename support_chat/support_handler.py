@@ -1,13 +1,17 @@
 # support_handler.py
 import os
-import json
 import asyncio
-from datetime import datetime, timedelta
+import atexit
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, List, Any
-from dataclasses import dataclass, asdict
+from typing import Deque, Dict, Optional, List, Any, Set, Tuple
+from dataclasses import dataclass, field
 import time
 
+import orjson
 from dotenv import load_dotenv
 from maxapi.types import Attachment, OtherAttachmentPayload, CallbackButton, ButtonsPayload
 from maxapi.utils.inline_keyboard import AttachmentType
@@ -20,32 +24,157 @@ from logging_config import log_user_event, log_system_event, log_security_event
 # Используем здесь прямую генерацию клавиатур или перенесем create_keyboard в отдельный модуль.
 # Используем здесь прямую генерацию клавиатур или перенесем create_keyboard в отдельный модуль.
 # Пока используем maxapi напрямую.
-from user_database import db
+from user_database import db, run_db
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Настройки из .env
-ADMIN_ID = os.getenv("ADMIN_ID")
-if ADMIN_ID:
-    ADMIN_ID = int(ADMIN_ID)
+_admin_id_raw = os.getenv("ADMIN_ID", "").strip()
+ADMIN_ID: Optional[int] = int(_admin_id_raw) if _admin_id_raw.isdigit() else None
+if _admin_id_raw and ADMIN_ID is None:
+    # Некорректное значение не должно ронять импорт: чат поддержки работает без администратора
+    log_system_event("support_chat", "invalid_admin_id", value=_admin_id_raw)
 
 # Константы
 TICKETS_DIR = Path("tickets")
 INACTIVITY_TIMEOUT = 3600  # 1 час в секундах
 LOG_RETENTION_DAYS = 30  # Хранить логи 30 дней
+LOG_FLUSH_INTERVAL = 0.5  # Сохранять лог чата не чаще раза в полсекунды
+ADMIN_CHAT_ID_CACHE_TTL = 300  # Сколько секунд доверяем закешированному chat_id администратора
+QUEUED_MESSAGES_CONCURRENCY = 5  # Сколько сообщений из очереди ожидания отправлять админу одновременно
+
+# Значения типа вложения, означающие изображение
+_IMAGE_TYPES = frozenset(("image", AttachmentType.IMAGE))
+
+# Последняя отформатированная метка времени (секунда, строка)
+_last_timestamp = (0, "")
+
+
+def _now_str() -> str:
+    """Текущее время в формате "%Y-%m-%d %H:%M:%S"; строка форматируется не чаще раза в секунду"""
+    global _last_timestamp
+    second = int(time.time())
+    if second != _last_timestamp[0]:
+        _last_timestamp = (second, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second)))
+    return _last_timestamp[1]
+
+
+def _inline_keyboard(buttons: List[List[CallbackButton]]) -> Attachment:
+    """Inline-клавиатура из рядов кнопок"""
+    return Attachment(type=AttachmentType.INLINE_KEYBOARD, payload=ButtonsPayload(buttons=buttons))
+
+
+# Постоянные клавиатуры чата поддержки собираются один раз при импорте
+_KB_CONNECT_OPERATOR = _inline_keyboard([[
+    CallbackButton(text="Связаться с оператором", payload="support_connect_operator"),
+    CallbackButton(text="Главное меню", payload="main_menu"),
+]])
+_KB_WAIT_IN_QUEUE = _inline_keyboard([[
+    CallbackButton(text="Подождать оператора", payload="support_wait_in_queue"),
+    CallbackButton(text="Главное меню", payload="main_menu"),
+]])
+
+# Постоянные тексты ответов — собираются один раз при импорте модуля
+_MSG_ALREADY_IN_CHAT = "Вы уже находитесь в чате с техподдержкой.\n\nЧтобы выйти — отправьте цифру 0."
+_MSG_SUPPORT_INFO = (
+    "Мы на связи по будням с 9:00 до 18:00 и помогаем только по вопросам работы бота!\n\n"
+    "По другим вопросам рекомендуем обратиться в Единый контакт-центр здравоохранения по бесплатному телефону 122."
+)
+_MSG_OPERATOR_BUSY = "⏳ Оператор занят. Вы добавлены в очередь ожидания."
+_MSG_CHAT_STARTED = (
+    "Опишите вашу проблему или вопрос. Как только оператор подключится, он увидит все ваши сообщения.\n"
+    "Для завершения чата отправьте цифру 0."
+)
+_MSG_IN_QUEUE = "Вы в очереди. Как только оператор освободится, с вами свяжутся."
+_MSG_OPERATOR_FREE = (
+    "⏳ Оператор освободился. Опишите вашу проблему или вопрос. Как только оператор подключится, "
+    "он увидит все ваши сообщения.\n\nЧтобы выйти из чата — отправьте цифру 0."
+)
+_MSG_CHAT_ENDED = "Чат с техподдержкой завершён."
+_MSG_CHAT_ENDED_INACTIVE = "Чат автоматически завершен из-за неактивности."
+_MSG_NOT_ADMIN = "❌ У вас нет права администратора."
+_MSG_ADMIN_ALREADY_IN_CHAT = "👨‍⚕️ Вы уже в диалоге с этим пользователем."
+_MSG_CHAT_TAKEN = "❌ Этот чат уже обрабатывается другим оператором."
+_MSG_NO_ACTIVE_CHAT = "❌ У вас нет активного чата для завершения."
+_MSG_CHAT_NOT_FOUND = "❌ Чат с пользователем не найден или уже завершен."
+
+# Подтверждение администратору о подключении к чату
+_ADMIN_CHAT_STARTED_TEXT = (
+    "✅ Вы начал диалог с пользователем {user_id}.\n\n"
+    "Все ваши текстовые сообщения будут пересылаться ему.\n\n"
+    "Для завершения чата отправьте цифру 0."
+)
+
+# Уведомление администратору о новом чате
+_ADMIN_NEW_CHAT_TEXT = (
+    "🆕 Новый чат от пользователя:\n\n"
+    "👤 ID: {user_id}\n"
+    "👤 Имя: {fio}\n"
+    "📞 Телефон: {phone}\n\n"
+    "Для подключения нажмите на кнопку:"
+)
+
+
+class ChatLogWriter:
+    """
+    Фоновая запись логов чатов в отдельном потоке.
+    Для каждого файла хранится только последний снимок: если поток не успел записать
+    предыдущую версию лога, она заменяется новой (несколько сохранений -> одна запись).
+    """
+
+    def __init__(self):
+        self._pending: Dict[Path, bytes] = {}
+        self._cond = threading.Condition()
+        # Держится на время записи пачки, чтобы более старый снимок не перезаписал более новый
+        self._io_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, filepath: Path, data: bytes):
+        """Ставит снимок лога в очередь на запись (заменяя ещё не записанный)"""
+        with self._cond:
+            self._pending[filepath] = data
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+                self._thread.start()
+                # При завершении процесса дописываем то, что осталось в очереди
+                atexit.register(self.flush)
+            self._cond.notify()
+
+    def flush(self):
+        """Записывает все ожидающие снимки (в вызывающем потоке)"""
+        with self._io_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            for filepath, data in batch.items():
+                try:
+                    self._write_file(filepath, data)
+                except OSError as e:
+                    log_system_event("support_chat", "save_log_error", error=str(e), file=filepath.name)
+
+    @staticmethod
+    def _write_file(filepath: Path, data: bytes):
+        """Перезаписывает файл через os.open/os.write — без файлового объекта и буферов Python"""
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            self.flush()
 
 
-@dataclass
-class ChatMessage:
-    """Структура сообщения в чате"""
-    from_user: str  # "user" или "admin"
-    text: str
-    time: str
-    image_url: Optional[str] = None  # URL изображения, если есть
+_chat_log_writer = ChatLogWriter()
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatLog:
     """Структура лога чата"""
     user_id: int
@@ -54,7 +183,29 @@ class ChatLog:
     admin_id: Optional[int]
     start_time: str
     end_time: Optional[str]
-    messages: List[ChatMessage]
+    log_filename: str  # Имя файла лога, создаётся один раз при создании чата
+    # Сообщения хранятся сразу в формате файла лога: {"from", "text", "time", "image_url"},
+    # поэтому при сохранении список не пересобирается
+    messages: List[Dict[str, Any]]
+
+    def add_message(self, from_user: str, text: str, image_url: Optional[str] = None):
+        """Добавляет сообщение в лог (from_user: "user" или "admin")"""
+        self.messages.append({"from": from_user, "text": text, "time": _now_str(), "image_url": image_url})
+
+
+@dataclass(slots=True)
+class ChatState:
+    """Состояние активного чата поддержки"""
+    chat_id: int
+    user_data: dict
+    last_activity: float  # time.monotonic() последнего сообщения
+    waiting_for_admin: bool = True
+    admin_id: Optional[int] = None
+    # Сообщения, отправленные до подключения админа: (текст, URL изображения, время)
+    messages_queue: list = field(default_factory=list)
+    # Упорядочивает пересылку сообщений внутри одного чата (другие чаты не блокирует)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending_notification: Optional[str] = None  # Уведомление, которое отправит notification_worker
 
 
 class SupportHandler:
@@ -63,8 +214,8 @@ class SupportHandler:
         self.admin_id = ADMIN_ID
 
         # Структуры для управления чатами
-        self.active_chats: Dict[int, Dict] = {}  # user_id -> chat_info
-        self.waiting_queue: List[Dict] = []  # Очередь ожидающих пользователей
+        self.active_chats: Dict[int, ChatState] = {}  # user_id -> chat_info
+        self.waiting_queue: Deque[Dict] = deque()  # Очередь ожидающих пользователей (FIFO)
         self.admin_active_chat: Optional[int] = None  # user_id с которым общается админ
         self.chat_logs: Dict[int, ChatLog] = {}  # Активные логи чатов
         self.pending_queue_confirm: Dict[int, dict] = {}  # chat_id -> {user_id, chat_id, user_data} при «оператор занят»
@@ -76,6 +227,15 @@ class SupportHandler:
         # Запускаем фоновую задачу для проверки неактивности
         self._cleanup_task = None
 
+        # Чаты, лог которых изменился с последнего сохранения, и задача их отложенного сохранения
+        self._dirty_logs: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        # При завершении процесса сохраняем и то, что еще ждет отложенного сохранения
+        atexit.register(self.flush_chat_logs)
+
+        # admin_id -> (chat_id администратора, время получения по time.monotonic())
+        self._admin_chat_ids: Dict[int, Tuple[int, float]] = {}
+
     def _ensure_tickets_dir(self):
         """Создает папку для логов если ее нет"""
         if not TICKETS_DIR.exists():
@@ -99,12 +259,11 @@ class SupportHandler:
 
     async def _check_inactive_chats(self):
         """Проверяет и завершает неактивные чаты"""
-        current_time = time.time()
+        current_time = time.monotonic()
         chats_to_end = []
 
         for user_id, chat_info in list(self.active_chats.items()):
-            last_activity = chat_info.get('last_activity', 0)
-            if current_time - last_activity > INACTIVITY_TIMEOUT:
+            if current_time - chat_info.last_activity > INACTIVITY_TIMEOUT:
                 chats_to_end.append(user_id)
 
         for user_id in chats_to_end:
@@ -133,21 +292,22 @@ class SupportHandler:
         log_system_event("support_chat", "auto_ended", user_id=user_id)
 
     async def _cleanup_old_logs(self):
-        """Удаляет старые логи (старше 30 дней)"""
+        """Удаляет старые логи (старше 30 дней) в пуле потоков, не блокируя цикл событий"""
+        await asyncio.to_thread(self._delete_old_logs)
+
+    def _delete_old_logs(self):
+        """Обход папки тикетов и удаление логов, не изменявшихся дольше срока хранения (блокирующая операция)"""
         try:
-            cutoff_date = datetime.now() - timedelta(days=LOG_RETENTION_DAYS)
+            cutoff_ts = time.time() - LOG_RETENTION_DAYS * 86400
 
-            for log_file in TICKETS_DIR.glob("*.json"):
-                try:
-                    # Пытаемся получить дату из имени файла
-                    file_date_str = log_file.stem.split('_')[-1]
-                    file_date = datetime.strptime(file_date_str, "%Y-%m-%d_%H-%M")
-
-                    if file_date < cutoff_date:
-                        log_file.unlink()
-                        log_system_event("support_chat", "old_log_deleted", file=log_file.name)
-                except (ValueError, IndexError):
-                    continue
+            with os.scandir(TICKETS_DIR) as entries:
+                for entry in entries:
+                    try:
+                        if entry.name.endswith(".json") and entry.stat(follow_symlinks=False).st_mtime < cutoff_ts:
+                            os.unlink(entry.path)
+                            log_system_event("support_chat", "old_log_deleted", file=entry.name)
+                    except OSError:
+                        continue
         except Exception as e:
             log_system_event("support_chat", "cleanup_logs_error", error=str(e))
 
@@ -156,20 +316,48 @@ class SupportHandler:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         return f"{user_id}_{timestamp}.json"
 
-    def _get_log_filename(self, user_id: int) -> Optional[str]:
-        """Получает имя файла лога для чата (создает если не существует)"""
-        chat_info = self.active_chats.get(user_id)
-        if not chat_info:
+    async def _get_admin_chat_id(self, admin_id: int) -> Optional[int]:
+        """chat_id администратора из БД с кешем на ADMIN_CHAT_ID_CACHE_TTL секунд.
+        При промахе кеша запрос к БД выполняется в пуле потоков, чтобы не блокировать event loop"""
+        now = time.monotonic()
+        cached = self._admin_chat_ids.get(admin_id)
+        if cached is not None and now - cached[1] < ADMIN_CHAT_ID_CACHE_TTL:
+            return cached[0]
+
+        chat_id = await run_db(db.get_last_chat_id, admin_id)
+        if chat_id:
+            self._admin_chat_ids[admin_id] = (chat_id, now)
+        return chat_id
+
+    async def _end_chat_admin_chat_id(self, admin_id: int, user_id: int) -> Optional[int]:
+        """chat_id администратора для уведомления о завершении чата (ошибка БД не мешает уведомить пользователя)"""
+        try:
+            return await self._get_admin_chat_id(admin_id)
+        except Exception as e:
+            log_system_event("support_chat", "end_notification_admin_error",
+                             error=str(e), admin_id=admin_id, user_id=user_id)
             return None
-        
-        # Если имя файла уже создано, возвращаем его
-        if 'log_filename' in chat_info:
-            return chat_info['log_filename']
-        
-        # Создаем новое имя файла и сохраняем его
-        filename = self._create_log_filename(user_id)
-        chat_info['log_filename'] = filename
-        return filename
+
+    def _mark_log_dirty(self, user_id: int):
+        """Помечает лог чата для сохранения; несколько сообщений подряд дают одну запись"""
+        self._dirty_logs.add(user_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_worker())
+
+    async def _flush_worker(self):
+        """Фоновая задача: раз в LOG_FLUSH_INTERVAL сохраняет изменившиеся логи, пока они есть"""
+        while self._dirty_logs:
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+            dirty, self._dirty_logs = self._dirty_logs, set()
+            for user_id in dirty:
+                self._save_chat_log(user_id)
+
+    def flush_chat_logs(self):
+        """Сохраняет все отложенные логи и дожидается их записи (при остановке бота)"""
+        dirty, self._dirty_logs = self._dirty_logs, set()
+        for user_id in dirty:
+            self._save_chat_log(user_id)
+        _chat_log_writer.flush()
 
     def _save_chat_log(self, user_id: int, end_chat: bool = False):
         """Сохраняет лог чата в файл (обновляет один и тот же файл)"""
@@ -180,7 +368,7 @@ class SupportHandler:
             chat_log = self.chat_logs[user_id]
 
             if end_chat:
-                chat_log.end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                chat_log.end_time = _now_str()
 
             # Конвертируем в словарь
             log_dict = {
@@ -190,30 +378,16 @@ class SupportHandler:
                 "admin_id": chat_log.admin_id,
                 "start_time": chat_log.start_time,
                 "end_time": chat_log.end_time,
-                "messages": [
-                    {
-                        "from": msg.from_user,
-                        "text": msg.text,
-                        "time": msg.time,
-                        "image_url": msg.image_url
-                    }
-                    for msg in chat_log.messages
-                ]
+                "messages": chat_log.messages
             }
 
-            # Получаем имя файла (используем сохраненное или создаем новое)
-            filename = self._get_log_filename(user_id)
-            if not filename:
-                # Если чат уже завершен, создаем имя файла на основе start_time
-                start_time_obj = datetime.strptime(chat_log.start_time, "%Y-%m-%d %H:%M:%S")
-                timestamp = start_time_obj.strftime("%Y-%m-%d_%H-%M-%S")
-                filename = f"{user_id}_{timestamp}.json"
-            
+            # Имя файла хранится в логе, поэтому оно доступно и после удаления чата из active_chats
+            filename = chat_log.log_filename
             filepath = TICKETS_DIR / filename
 
-            # Сохраняем/обновляем файл
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(log_dict, f, ensure_ascii=False, indent=2)
+            # Сериализуем сейчас, а запись файла отдаём фоновому потоку
+            data = orjson.dumps(log_dict, option=orjson.OPT_INDENT_2)
+            _chat_log_writer.submit(filepath, data)
 
             if end_chat:
                 log_user_event(str(user_id), "chat_log_saved", filename=filename)
@@ -232,7 +406,7 @@ class SupportHandler:
         if user_id in self.active_chats:
             await bot.send_message(
                 chat_id=chat_id,
-                text="Вы уже находитесь в чате с техподдержкой.\n\nЧтобы выйти — отправьте цифру 0."
+                text=_MSG_ALREADY_IN_CHAT
             )
             return
 
@@ -242,21 +416,10 @@ class SupportHandler:
             'chat_id': chat_id,
             'user_data': user_data,
         }
-        buttons_payload = ButtonsPayload(buttons=[[
-            CallbackButton(text="Связаться с оператором", payload="support_connect_operator"),
-            CallbackButton(text="Главное меню", payload="main_menu"),
-        ]])
-        keyboard = Attachment(
-            type=AttachmentType.INLINE_KEYBOARD,
-            payload=buttons_payload
-        )
         await bot.send_message(
             chat_id=chat_id,
-            text=(
-                "Мы на связи по будням с 9:00 до 18:00 и помогаем только по вопросам работы бота!\n\n"
-                "По другим вопросам рекомендуем обратиться в Единый контакт-центр здравоохранения по бесплатному телефону 122."
-            ),
-            attachments=[keyboard]
+            text=_MSG_SUPPORT_INFO,
+            attachments=[_KB_CONNECT_OPERATOR]
         )
 
     async def handle_connect_operator(self, bot, user_id: int, chat_id: int) -> bool:
@@ -268,25 +431,17 @@ class SupportHandler:
 
         if self.admin_active_chat is not None:
             self.pending_queue_confirm[chat_id] = {'user_id': uid, 'chat_id': cid, 'user_data': ud}
-            buttons_payload = ButtonsPayload(buttons=[[
-                CallbackButton(text="Подождать оператора", payload="support_wait_in_queue"),
-                CallbackButton(text="Главное меню", payload="main_menu"),
-            ]])
-            keyboard = Attachment(type=AttachmentType.INLINE_KEYBOARD, payload=buttons_payload)
             await bot.send_message(
                 chat_id=chat_id,
-                text="⏳ Оператор занят. Вы добавлены в очередь ожидания.",
-                attachments=[keyboard]
+                text=_MSG_OPERATOR_BUSY,
+                attachments=[_KB_WAIT_IN_QUEUE]
             )
             return True
 
         self._create_new_chat(uid, cid, ud)
         await bot.send_message(
             chat_id=chat_id,
-            text=(
-                "Опишите вашу проблему или вопрос. Как только оператор подключится, он увидит все ваши сообщения.\n"
-                "Для завершения чата отправьте цифру 0."
-            )
+            text=_MSG_CHAT_STARTED
         )
         await self._notify_admin_new_chat(bot, uid, cid, ud)
         log_user_event(uid, "chat_requested")
@@ -311,7 +466,7 @@ class SupportHandler:
         await self._notify_admin_new_chat(bot, data['user_id'], data['chat_id'], data['user_data'])
         await bot.send_message(
             chat_id=chat_id,
-            text="Вы в очереди. Как только оператор освободится, с вами свяжутся."
+            text=_MSG_IN_QUEUE
         )
         log_user_event(user_id, "added_to_waiting_queue")
         return True
@@ -327,12 +482,12 @@ class SupportHandler:
             return (True, False)
 
         # Пользователь в очереди — удаляем, уведомляем админа
-        for i, item in enumerate(self.waiting_queue):
+        for item in self.waiting_queue:
             if item.get("user_id") == user_id:
-                self.waiting_queue.pop(i)
+                self.waiting_queue.remove(item)
                 if self.admin_id:
                     try:
-                        admin_chat_id = db.get_last_chat_id(self.admin_id)
+                        admin_chat_id = await self._get_admin_chat_id(self.admin_id)
                         if admin_chat_id:
                             await bot.send_message(
                                 chat_id=admin_chat_id,
@@ -353,32 +508,30 @@ class SupportHandler:
 
     def _create_new_chat(self, user_id: int, chat_id: int, user_data: dict):
         """Создает новую структуру чата"""
+        # Создаем имя файла для лога один раз при создании чата
+        log_filename = self._create_log_filename(user_id)
+
         # Создаем лог чата
         chat_log = ChatLog(
             user_id=user_id,
             user_name=user_data.get('fio', 'Неизвестно'),
             user_phone=user_data.get('phone', 'Не указан'),
             admin_id=None,
-            start_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            start_time=_now_str(),
             end_time=None,
+            log_filename=log_filename,
             messages=[]
         )
 
         # Сохраняем в памяти
         self.chat_logs[user_id] = chat_log
 
-        # Создаем имя файла для лога один раз при создании чата
-        log_filename = self._create_log_filename(user_id)
-
         # Добавляем в активные чаты
-        self.active_chats[user_id] = {
-            'chat_id': chat_id,
-            'user_data': user_data,
-            'last_activity': time.time(),
-            'waiting_for_admin': True,
-            'messages_queue': [],  # Сообщения, отправленные до подключения админа
-            'log_filename': log_filename  # Сохраняем имя файла для этого чата
-        }
+        self.active_chats[user_id] = ChatState(
+            chat_id=chat_id,
+            user_data=user_data,
+            last_activity=time.monotonic()
+        )
 
         log_user_event(user_id, "chat_created", log_filename=log_filename)
 
@@ -394,32 +547,23 @@ class SupportHandler:
 
         try:
             # Получаем chat_id администратора
-            admin_chat_id = db.get_last_chat_id(self.admin_id)
+            admin_chat_id = await self._get_admin_chat_id(self.admin_id)
             if not admin_chat_id:
                 log_system_event("support_chat", "admin_chat_id_not_found_for_notification", admin_id=self.admin_id)
                 # Если не нашли чат админа, можно попробовать записать в лог или отправить в "никуда", 
                 # но лучше просто выйти, так как отправить некому.
                 return
 
-            message = (
-                f"🆕 Новый чат от пользователя:\n\n"
-                f"👤 ID: {user_id}\n"
-                f"👤 Имя: {user_data.get('fio', 'Неизвестно')}\n"
-                f"📞 Телефон: {user_data.get('phone', 'Не указан')}\n\n"
-                f"Для подключения нажмите на кнопку:"
+            message = _ADMIN_NEW_CHAT_TEXT.format(
+                user_id=user_id,
+                fio=user_data.get('fio', 'Неизвестно'),
+                phone=user_data.get('phone', 'Не указан')
             )
 
-            # Создаем кнопку для начала диалога
-            buttons_payload = ButtonsPayload(buttons=[[
-                CallbackButton(
-                    text="Начать диалог",
-                    payload=f"start_chat:{user_id}"
-                )
+            # Кнопка для начала диалога (payload зависит от пользователя)
+            keyboard = _inline_keyboard([[
+                CallbackButton(text="Начать диалог", payload=f"start_chat:{user_id}")
             ]])
-            keyboard = Attachment(
-                type=AttachmentType.INLINE_KEYBOARD,
-                payload=buttons_payload
-            )
 
             await bot.send_message(
                 chat_id=admin_chat_id,
@@ -438,8 +582,11 @@ class SupportHandler:
         try:
             # Получаем chat_id для админа если он не передан
             target_admin_chat_id = admin_chat_id
-            if not target_admin_chat_id:
-                target_admin_chat_id = db.get_last_chat_id(admin_id)
+            if target_admin_chat_id:
+                # Админ только что написал из этого чата — обновляем кеш, чтобы не ждать истечения TTL
+                self._admin_chat_ids[admin_id] = (target_admin_chat_id, time.monotonic())
+            else:
+                target_admin_chat_id = await self._get_admin_chat_id(admin_id)
             
             if not target_admin_chat_id:
                 log_system_event("support_chat", "admin_chat_id_not_found", admin_id=admin_id)
@@ -449,7 +596,7 @@ class SupportHandler:
             if admin_id != self.admin_id:
                 await bot.send_message(
                     chat_id=target_admin_chat_id,
-                    text="❌ У вас нет права администратора."
+                    text=_MSG_NOT_ADMIN
                 )
                 return False
 
@@ -465,7 +612,7 @@ class SupportHandler:
             if self.admin_active_chat == user_id:
                  await bot.send_message(
                     chat_id=target_admin_chat_id,
-                    text=f"👨‍⚕️ Вы уже в диалоге с этим пользователем."
+                    text=_MSG_ADMIN_ALREADY_IN_CHAT
                 )
                  return True
 
@@ -479,11 +626,11 @@ class SupportHandler:
 
             # Проверяем, не подключен ли уже другой админ (или этот же)
             chat_info = self.active_chats[user_id]
-            if not chat_info.get('waiting_for_admin', True):
-                 if chat_info.get('admin_id') != admin_id:
+            if not chat_info.waiting_for_admin:
+                 if chat_info.admin_id != admin_id:
                     await bot.send_message(
                         chat_id=admin_id,
-                        text="❌ Этот чат уже обрабатывается другим оператором."
+                        text=_MSG_CHAT_TAKEN
                     )
                     return False
 
@@ -491,77 +638,52 @@ class SupportHandler:
             if user_id in self.chat_logs:
                  self.chat_logs[user_id].admin_id = admin_id
 
-            # Подключаем админа
-            self.admin_active_chat = user_id
-            chat_info['waiting_for_admin'] = False
-            chat_info['admin_id'] = admin_id
-            chat_info['last_activity'] = time.time()
+            # Пока пересылаются накопленные сообщения, новые сообщения этого чата ждут,
+            # чтобы администратор получил их в исходном порядке
+            async with chat_info.lock:
+                # Подключаем админа
+                self.admin_active_chat = user_id
+                chat_info.waiting_for_admin = False
+                chat_info.admin_id = admin_id
+                chat_info.last_activity = time.monotonic()
 
-            # Отправляем подтверждение админу
-            await bot.send_message(
-                chat_id=target_admin_chat_id,
-                text=f"✅ Вы начал диалог с пользователем {user_id}.\n\nВсе ваши текстовые сообщения будут пересылаться ему.\n\nДля завершения чата отправьте цифру 0."
-            )
-            success_message_sent = True
+                # Отправляем подтверждение админу
+                await bot.send_message(
+                    chat_id=target_admin_chat_id,
+                    text=_ADMIN_CHAT_STARTED_TEXT.format(user_id=user_id)
+                )
+                success_message_sent = True
 
-            # Отправляем накопленные сообщения от пользователя админу
-            messages_queue = chat_info.get('messages_queue', [])
-            if messages_queue:
-                try:
-                    await bot.send_message(
-                        chat_id=target_admin_chat_id,
-                        text=f"📨 Сообщения от пользователя (отправлены до вашего подключения):"
-                    )
+                # Отправляем накопленные сообщения от пользователя админу: заголовок, затем
+                # каждое сообщение отдельно (с временем отправки), по несколько одновременно
+                messages_queue = chat_info.messages_queue
+                if messages_queue:
+                    try:
+                        await bot.send_message(
+                            chat_id=target_admin_chat_id,
+                            text="📨 Сообщения от пользователя (отправлены до вашего подключения):"
+                        )
+                    except Exception as e:
+                        log_system_event("support_chat", "send_queue_header_error",
+                                       error=str(e), user_id=user_id, admin_id=admin_id)
+                        # Продолжаем выполнение, даже если не удалось отправить заголовок очереди
 
-                    for msg in messages_queue:
-                        try:
-                            # Поддерживаем как старый формат (строка), так и новый (словарь)
-                            if isinstance(msg, dict):
-                                message_text = msg.get('text', '[Изображение]')
-                                image_url = msg.get('image_url')
-                            else:
-                                message_text = msg
-                                image_url = None
-                            
-                            message_text_to_send = f"👤 Пользователь: {message_text}"
-                            
-                            # Формируем attachments для пересылки изображения
-                            message_attachments = []
-                            if image_url:
-                                try:
-                                    image_attachment = Attachment(
-                                        type=AttachmentType.IMAGE,
-                                        payload=OtherAttachmentPayload(url=image_url)
-                                    )
-                                    message_attachments.append(image_attachment)
-                                except Exception as e:
-                                    log_system_event("support_chat", "create_image_attachment_error",
-                                                   error=str(e), user_id=user_id)
-                                    message_text_to_send += f"\n\n📷 Изображение: {image_url}"
-                            
-                            await bot.send_message(
-                                chat_id=target_admin_chat_id,
-                                text=message_text_to_send,
-                                attachments=message_attachments if message_attachments else []
-                            )
-                        except Exception as e:
-                            log_system_event("support_chat", "send_queued_message_error",
-                                           error=str(e), user_id=user_id, admin_id=admin_id)
-                            # Продолжаем отправку остальных сообщений
-                except Exception as e:
-                    log_system_event("support_chat", "send_queue_header_error",
-                                   error=str(e), user_id=user_id, admin_id=admin_id)
-                    # Продолжаем выполнение, даже если не удалось отправить заголовок очереди
-
-            # Очищаем очередь
-            chat_info['messages_queue'] = []
+                    sem = asyncio.Semaphore(QUEUED_MESSAGES_CONCURRENCY)
+                    total = len(messages_queue)
+                    await asyncio.gather(*(
+                        self._send_queued_message(bot, target_admin_chat_id, msg, f"{index}/{total}",
+                                                  user_id, admin_id, sem)
+                        for index, msg in enumerate(messages_queue, 1)
+                    ))
+
+                # Очищаем очередь
+                chat_info.messages_queue = []
 
             log_user_event(str(user_id), "admin_connected", admin_id=admin_id)
             log_security_event(str(admin_id), "chat_started", target_user_id=user_id)
 
             return True
         except Exception as e:
-            import traceback
             error_traceback = traceback.format_exc()
             log_system_event("support_chat", "connect_admin_error",
                            error=str(e), user_id=user_id, admin_id=admin_id, 
@@ -580,40 +702,64 @@ class SupportHandler:
             # все равно возвращаем True, так как подключение фактически состоялось
             return success_message_sent
 
+    async def _send_queued_message(self, bot, admin_chat_id: int, msg: Tuple[str, Optional[str], str],
+                                   position: str, user_id: int, admin_id: int, sem: asyncio.Semaphore):
+        """Отправляет администратору одно сообщение пользователя из очереди ожидания"""
+        message_text, image_url, sent_at = msg
+
+        # Сообщения уходят параллельно и могут прийти не по порядку: номер в очереди ("2/5")
+        # восстанавливает исходный порядок, время показывает, когда сообщение было отправлено
+        message_text_to_send = f"👤 Пользователь [{position}, {sent_at}]: {message_text}"
+
+        # Формируем attachments для пересылки изображения
+        message_attachments = []
+        if image_url:
+            try:
+                image_attachment = Attachment(
+                    type=AttachmentType.IMAGE,
+                    payload=OtherAttachmentPayload(url=image_url)
+                )
+                message_attachments.append(image_attachment)
+            except Exception as e:
+                log_system_event("support_chat", "create_image_attachment_error",
+                               error=str(e), user_id=user_id)
+                message_text_to_send += f"\n\n📷 Изображение: {image_url}"
+
+        async with sem:
+            try:
+                await bot.send_message(
+                    chat_id=admin_chat_id,
+                    text=message_text_to_send,
+                    attachments=message_attachments
+                )
+            except Exception as e:
+                # Ошибка одного сообщения не мешает отправке остальных
+                log_system_event("support_chat", "send_queued_message_error",
+                               error=str(e), user_id=user_id, admin_id=admin_id)
+
     def _extract_image_url(self, attachments: Optional[List[Attachment]]) -> Optional[str]:
         """Извлекает URL изображения из attachments"""
         if not attachments:
             return None
         
         for attachment in attachments:
-            # Проверяем тип attachment
-            if hasattr(attachment, 'type'):
-                attachment_type = attachment.type
-                # Может быть строкой "image" или AttachmentType.IMAGE
-                is_image = (
-                    attachment_type == "image" or 
-                    str(attachment_type).lower() == "image" or
-                    (hasattr(AttachmentType, 'IMAGE') and attachment_type == AttachmentType.IMAGE)
-                )
-                
-                if is_image:
-                    # Извлекаем URL из payload
-                    if hasattr(attachment, 'payload'):
-                        payload = attachment.payload
-                        # Проверяем разные варианты payload
-                        if hasattr(payload, 'url'):
-                            return payload.url
-                        elif isinstance(payload, dict):
-                            return payload.get('url') or payload.get('token')
-                        elif hasattr(payload, 'token'):
-                            # Если есть токен, можно использовать его для получения URL
-                            token = getattr(payload, 'token', None)
-                            if token:
-                                # Формируем URL из токена (если нужно)
-                                return token
-                    # Если payload нет или не удалось извлечь, пробуем получить напрямую
-                    if hasattr(attachment, 'url'):
-                        return attachment.url
+            # Тип может быть строкой "image" или AttachmentType.IMAGE
+            attachment_type = getattr(attachment, 'type', None)
+            if attachment_type not in _IMAGE_TYPES and not (
+                isinstance(attachment_type, str) and attachment_type.lower() == "image"
+            ):
+                continue
+
+            # Извлекаем URL из payload (объект или словарь; вместо URL может прийти токен),
+            # а если не удалось — пробуем получить напрямую из attachment
+            payload = getattr(attachment, 'payload', None)
+            if isinstance(payload, dict):
+                url = payload.get('url') or payload.get('token')
+            else:
+                url = getattr(payload, 'url', None) or getattr(payload, 'token', None)
+            url = url or getattr(attachment, 'url', None)
+            if url:
+                return url
         return None
 
     async def process_user_message(self, bot, user_id: int, message_text: str, attachments: Optional[List[Attachment]] = None) -> bool:
@@ -628,37 +774,24 @@ class SupportHandler:
             return False
 
         chat_info = self.active_chats[user_id]
-        chat_info['last_activity'] = time.time()
+        chat_info.last_activity = time.monotonic()
 
         # Извлекаем URL изображения, если есть
         image_url = self._extract_image_url(attachments)
 
         # Добавляем сообщение в лог
         if user_id in self.chat_logs:
-            self.chat_logs[user_id].messages.append(
-                ChatMessage(
-                    from_user="user",
-                    text=message_text or "[Изображение]",
-                    time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    image_url=image_url
-                )
-            )
-            # Обновляем один и тот же файл при каждом сообщении
-            self._save_chat_log(user_id)
+            self.chat_logs[user_id].add_message("user", message_text or "[Изображение]", image_url)
+            # Файл лога обновится фоновой задачей (с объединением частых сообщений)
+            self._mark_log_dirty(user_id)
 
         # Если админ еще не подключен, сохраняем в очередь
-        if chat_info.get('waiting_for_admin', True):
-            messages_queue = chat_info.get('messages_queue', [])
-            queue_item = {
-                'text': message_text,
-                'image_url': image_url
-            }
-            messages_queue.append(queue_item)
-            chat_info['messages_queue'] = messages_queue
+        if chat_info.waiting_for_admin:
+            chat_info.messages_queue.append((message_text, image_url, _now_str()))
             return True
 
         # Если админ подключен - пересылаем сообщение
-        admin_id = chat_info.get('admin_id')
+        admin_id = chat_info.admin_id
         if admin_id:
             try:
                 # Формируем текст сообщения
@@ -679,17 +812,20 @@ class SupportHandler:
                         # Если не удалось создать attachment, просто добавим URL в текст
                         message_text_to_send += f"\n\n📷 Изображение: {image_url}"
                 
-                # Получаем chat_id администратора
-                target_admin_chat_id = db.get_last_chat_id(admin_id)
-                if not target_admin_chat_id:
-                    log_system_event("support_chat", "admin_chat_id_not_found_for_forwarding", admin_id=admin_id)
-                    return True # Сообщение не доставлено, но считаем обработанным во избежание ретраев
+                # Блокировка берётся до первого await: поиск chat_id администратора при промахе
+                # кеша уходит в поток, и без неё сообщения могли бы обогнать друг друга
+                async with chat_info.lock:
+                    # Получаем chat_id администратора
+                    target_admin_chat_id = await self._get_admin_chat_id(admin_id)
+                    if not target_admin_chat_id:
+                        log_system_event("support_chat", "admin_chat_id_not_found_for_forwarding", admin_id=admin_id)
+                        return True # Сообщение не доставлено, но считаем обработанным во избежание ретраев
 
-                await bot.send_message(
-                    chat_id=target_admin_chat_id,
-                    text=message_text_to_send,
-                    attachments=message_attachments if message_attachments else []
-                )
+                    await bot.send_message(
+                        chat_id=target_admin_chat_id,
+                        text=message_text_to_send,
+                        attachments=message_attachments if message_attachments else []
+                    )
                 return True
             except Exception as e:
                 log_system_event("support_chat", "forward_to_admin_error",
@@ -711,7 +847,7 @@ class SupportHandler:
                 else:
                     await bot.send_message(
                         chat_id=admin_id,
-                        text="❌ У вас нет активного чата для завершения."
+                        text=_MSG_NO_ACTIVE_CHAT
                     )
                 return True
 
@@ -725,34 +861,27 @@ class SupportHandler:
             if user_id not in self.active_chats:
                 await bot.send_message(
                     chat_id=admin_id,
-                    text="❌ Чат с пользователем не найден или уже завершен."
+                    text=_MSG_CHAT_NOT_FOUND
                 )
                 self.admin_active_chat = None
                 return False
 
             chat_info = self.active_chats[user_id]
-            chat_info['last_activity'] = time.time()
+            chat_info.last_activity = time.monotonic()
 
             # Извлекаем URL изображения, если есть
             image_url = self._extract_image_url(attachments)
 
             # Добавляем сообщение в лог
             if user_id in self.chat_logs:
-                self.chat_logs[user_id].messages.append(
-                    ChatMessage(
-                        from_user="admin",
-                        text=message_text or "[Изображение]",
-                        time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        image_url=image_url
-                    )
-                )
-                # Обновляем один и тот же файл при каждом сообщении
-                self._save_chat_log(user_id)
+                self.chat_logs[user_id].add_message("admin", message_text or "[Изображение]", image_url)
+                # Файл лога обновится фоновой задачей (с объединением частых сообщений)
+                self._mark_log_dirty(user_id)
 
             # Пересылаем сообщение пользователю
             # Пересылаем сообщение пользователю
             try:
-                target_chat_id = chat_info.get('chat_id')
+                target_chat_id = chat_info.chat_id
                 if not target_chat_id:
                      # Если вдруг chat_id нет (редко), пробуем взять user_id, но лучше бы из БД
                      target_chat_id = user_id
@@ -776,11 +905,12 @@ class SupportHandler:
                         # Если не удалось создать attachment, просто добавим URL в текст
                         message_text_to_send += f"\n\n📷 Изображение: {image_url}"
                 
-                await bot.send_message(
-                    chat_id=target_chat_id,
-                    text=message_text_to_send,
-                    attachments=message_attachments if message_attachments else []
-                )
+                async with chat_info.lock:
+                    await bot.send_message(
+                        chat_id=target_chat_id,
+                        text=message_text_to_send,
+                        attachments=message_attachments if message_attachments else []
+                    )
                 return True
             except Exception as e:
                 log_system_event("support_chat", "forward_to_user_error",
@@ -804,107 +934,87 @@ class SupportHandler:
             return
 
         # Сохраняем информацию перед очисткой структур
-        admin_id = chat_info.get('admin_id')
+        admin_id = chat_info.admin_id
 
-        # Отправляем уведомления напрямую через бота (до очистки структур)
+        # Отправляем уведомления напрямую через бота (до очистки структур).
+        # Уведомления пользователю и администратору независимы — отправляем их параллельно
         try:
-            target_chat_id = chat_info.get('chat_id') if chat_info else user_id
-            
+            from bot_utils import create_main_menu_keyboard
+            keyboard = create_main_menu_keyboard()
+            menu = [keyboard] if keyboard else []
+            target_chat_id = chat_info.chat_id or user_id
+            # (аргументы send_message, событие при ошибке, поля для лога). Корутины создаются только
+            # в gather: если отмена придёт во время поиска chat_id администратора, не останется
+            # созданных, но не запущенных отправок
+            sends = []
+
             if ended_by == "user":
                 # Пользователю + главное меню
-                try:
-                    if target_chat_id:
-                        from bot_utils import create_main_menu_keyboard
-                        keyboard = create_main_menu_keyboard()
-                        await bot.send_message(
-                            chat_id=target_chat_id,
-                            text="Чат с техподдержкой завершён.",
-                            attachments=[keyboard] if keyboard else []
-                        )
-                except Exception as e:
-                    log_system_event("support_chat", "end_notification_user_error",
-                                     error=str(e), user_id=user_id)
+                if target_chat_id:
+                    sends.append((
+                        dict(chat_id=target_chat_id, text=_MSG_CHAT_ENDED, attachments=menu),
+                        "end_notification_user_error", {"user_id": user_id}
+                    ))
 
                 # Админу (если подключен или если еще не подключился - уведомляем через self.admin_id)
                 target_admin_id = admin_id if admin_id else self.admin_id
                 if target_admin_id:
-                    try:
-                        # Получаем chat_id администратора
-                        target_admin_chat_id = db.get_last_chat_id(target_admin_id)
-                        if target_admin_chat_id:
-                            await bot.send_message(
-                                chat_id=target_admin_chat_id,
-                                text=f"Пользователь {user_id} завершил чат."
-                            )
-                    except Exception as e:
-                        log_system_event("support_chat", "end_notification_admin_error",
-                                         error=str(e), admin_id=target_admin_id, user_id=user_id)
+                    target_admin_chat_id = await self._end_chat_admin_chat_id(target_admin_id, user_id)
+                    if target_admin_chat_id:
+                        sends.append((
+                            dict(chat_id=target_admin_chat_id,
+                                 text=f"Пользователь {user_id} завершил чат."),
+                            "end_notification_admin_error", {"admin_id": target_admin_id, "user_id": user_id}
+                        ))
 
             elif ended_by == "admin":
                 # Пользователю + главное меню
-                try:
-                    if target_chat_id:
-                        from bot_utils import create_main_menu_keyboard
-                        keyboard = create_main_menu_keyboard()
-                        await bot.send_message(
-                            chat_id=target_chat_id,
-                            text="Чат с техподдержкой завершён.",
-                            attachments=[keyboard] if keyboard else []
-                        )
-                except Exception as e:
-                    log_system_event("support_chat", "end_notification_user_error",
-                                     error=str(e), user_id=user_id)
+                if target_chat_id:
+                    sends.append((
+                        dict(chat_id=target_chat_id, text=_MSG_CHAT_ENDED, attachments=menu),
+                        "end_notification_user_error", {"user_id": user_id}
+                    ))
 
                 # Админу (подтверждение) + главное меню
                 if admin_id:
-                    try:
-                        target_admin_chat_id = db.get_last_chat_id(admin_id)
-                        if target_admin_chat_id:
-                            from bot_utils import create_main_menu_keyboard
-                            keyboard = create_main_menu_keyboard()
-                            await bot.send_message(
-                                chat_id=target_admin_chat_id,
-                                text=f"Чат с пользователем {user_id} завершён.",
-                                attachments=[keyboard] if keyboard else []
-                            )
-                    except Exception as e:
-                        log_system_event("support_chat", "end_notification_admin_error",
-                                         error=str(e), admin_id=admin_id, user_id=user_id)
+                    target_admin_chat_id = await self._end_chat_admin_chat_id(admin_id, user_id)
+                    if target_admin_chat_id:
+                        sends.append((
+                            dict(chat_id=target_admin_chat_id,
+                                 text=f"Чат с пользователем {user_id} завершён.",
+                                 attachments=menu),
+                            "end_notification_admin_error", {"admin_id": admin_id, "user_id": user_id}
+                        ))
 
             elif ended_by == "system":
                 # Пользователю + главное меню
-                try:
-                    if target_chat_id:
-                        from bot_utils import create_main_menu_keyboard
-                        keyboard = create_main_menu_keyboard()
-                        await bot.send_message(
-                            chat_id=target_chat_id,
-                            text="Чат автоматически завершен из-за неактивности.",
-                            attachments=[keyboard] if keyboard else []
-                        )
-                except Exception as e:
-                    log_system_event("support_chat", "end_notification_user_error",
-                                     error=str(e), user_id=user_id)
+                if target_chat_id:
+                    sends.append((
+                        dict(chat_id=target_chat_id, text=_MSG_CHAT_ENDED_INACTIVE, attachments=menu),
+                        "end_notification_user_error", {"user_id": user_id}
+                    ))
 
                 # Админу (если подключен) + главное меню
                 if admin_id:
-                    try:
-                        target_admin_chat_id = db.get_last_chat_id(admin_id) or admin_id
-                        from bot_utils import create_main_menu_keyboard
-                        keyboard = create_main_menu_keyboard()
-                        await bot.send_message(
-                            chat_id=target_admin_chat_id,
-                            text=f"Чат с пользователем {user_id} автоматически завершен.",
-                            attachments=[keyboard] if keyboard else []
-                        )
-                    except Exception as e:
-                        log_system_event("support_chat", "end_notification_admin_error",
-                                         error=str(e), admin_id=admin_id, user_id=user_id)
+                    target_admin_chat_id = await self._end_chat_admin_chat_id(admin_id, user_id) or admin_id
+                    sends.append((
+                        dict(chat_id=target_admin_chat_id,
+                             text=f"Чат с пользователем {user_id} автоматически завершен.",
+                             attachments=menu),
+                        "end_notification_admin_error", {"admin_id": admin_id, "user_id": user_id}
+                    ))
+
+            results = await asyncio.gather(*(bot.send_message(**kwargs) for kwargs, _, _ in sends),
+                                           return_exceptions=True)
+            for (_, event, fields), result in zip(sends, results):
+                if isinstance(result, Exception):
+                    log_system_event("support_chat", event, error=str(result), **fields)
         except Exception as e:
             log_system_event("support_chat", "end_chat_notifications_error",
                              error=str(e), user_id=user_id)
 
-        # Сохраняем лог
+        # Сохраняем лог сразу (отложенное сохранение этого чата больше не нужно)
+        self._dirty_logs.discard(user_id)
         self._save_chat_log(user_id, end_chat=True)
 
         # Очищаем структуры
@@ -914,6 +1024,10 @@ class SupportHandler:
         if self.admin_active_chat == user_id:
             self.admin_active_chat = None
 
+        # chat_id администратора перечитаем из БД при следующем обращении
+        if admin_id:
+            self._admin_chat_ids.pop(admin_id, None)
+
         # Проверяем очередь ожидания
         await self._check_waiting_queue()
 
@@ -922,11 +1036,10 @@ class SupportHandler:
     async def _send_message_to_user(self, user_id: int, message: str):
         """Отправляет сообщение пользователю (через бота)"""
         # Эта функция будет вызываться из bot.py
-        # Сохраняем сообщение для отправки
-        if user_id not in self.active_chats:
-            self.active_chats[user_id] = {}
-
-        self.active_chats[user_id]['pending_notification'] = message
+        # Сохраняем сообщение для отправки (только для активного чата)
+        chat_info = self.active_chats.get(user_id)
+        if chat_info:
+            chat_info.pending_notification = message
 
     async def _send_message_to_admin(self, admin_id: int, message: str):
         """Отправляет сообщение админу (через бота)"""
@@ -943,7 +1056,7 @@ class SupportHandler:
             return
 
         # Берем первого пользователя из очереди
-        next_chat = self.waiting_queue.pop(0)
+        next_chat = self.waiting_queue.popleft()
         user_id = next_chat['user_id']
         chat_id = next_chat['chat_id']
         user_data = next_chat['user_data']
@@ -953,14 +1066,15 @@ class SupportHandler:
 
         bot = self._get_bot()
         if bot:
-            # Сообщаем пользователю, что оператор освободился
-            await bot.send_message(
-                chat_id=chat_id,
-                text="⏳ Оператор освободился. Опишите вашу проблему или вопрос. Как только оператор подключится, он увидит все ваши сообщения.\n\nЧтобы выйти из чата — отправьте цифру 0."
-            )
-            # Уведомляем админа о следующем пользователе в очереди
+            # Сообщаем пользователю, что оператор освободился, и параллельно
+            # уведомляем админа о следующем пользователе в очереди
+            sends = [bot.send_message(chat_id=chat_id, text=_MSG_OPERATOR_FREE)]
             if self.admin_id:
-                await self._notify_admin_new_chat(bot, user_id, chat_id, user_data)
+                sends.append(self._notify_admin_new_chat(bot, user_id, chat_id, user_data))
+            for result in await asyncio.gather(*sends, return_exceptions=True):
+                if isinstance(result, Exception):
+                    log_system_event("support_chat", "next_user_notification_error",
+                                     error=str(result), user_id=user_id)
 
         log_system_event("support_chat", "next_user_notified", user_id=user_id)
 
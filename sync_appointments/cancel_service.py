@@ -8,12 +8,20 @@
 import logging
 import os
 from typing import Any, Dict, Optional
+from xml.sax.saxutils import escape
 
 import aiohttp
 
 logger = logging.getLogger(__name__)
 
 
+def _xml_value(value: Any) -> bytes:
+    """Экранирует значение для подстановки в текст XML-элемента и кодирует в UTF-8"""
+    if value is None:
+        return b""
+    return escape(str(value)).encode("utf-8")
+
+
 class CancelService:
     """
     Отправляет SOAP-запрос CancelAppointmentRequest во внешнюю систему.
@@ -33,6 +41,36 @@ class CancelService:
         "SOAPAction": "CancelAppointment"  # раскомментировать, если сервер этого требует
     }
 
+    # SOAP Envelope как в предоставленном рабочем запросе; собирается один раз сразу в UTF-8,
+    # на каждый запрос подставляются только экранированные значения полей
+    _ENVELOPE_TEMPLATE = (
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+        b'xmlns:v2="http://www.rt-eu.ru/med/er/v2_0">'
+        b"<soapenv:Header/>"
+        b"<soapenv:Body>"
+        b"<v2:CancelAppointmentRequest>"
+        b"<v2:Book_Id_Mis>%b</v2:Book_Id_Mis>"
+        b"<v2:Canceled_Reason>%b</v2:Canceled_Reason>"
+        b"%b"
+        b"</v2:CancelAppointmentRequest>"
+        b"</soapenv:Body>"
+        b"</soapenv:Envelope>"
+    )
+    _ERROR_BLOCK_TEMPLATE = (
+        b"<v2:Error_Data_Parameters>"
+        b"<v2:Parameter>"
+        b"<v2:Message>%b</v2:Message>"
+        b"<v2:Path>%b</v2:Path>"
+        b"<v2:Value>%b</v2:Value>"
+        b"</v2:Parameter>"
+        b"</v2:Error_Data_Parameters>"
+    )
+
+    # Общая HTTP-сессия для всех экземпляров: переиспользует соединения (keep-alive)
+    # вместо DNS + TCP (+TLS) на каждый запрос отмены
+    _session: Optional[aiohttp.ClientSession] = None
+
     def __init__(
         self,
         endpoint_url: Optional[str] = None,
@@ -43,49 +81,49 @@ class CancelService:
         self.soap_action = soap_action or self.SOAP_ACTION
         self.timeout_seconds = timeout_seconds
 
+    @classmethod
+    async def _get_session(cls) -> aiohttp.ClientSession:
+        """Возвращает общую HTTP-сессию, создавая ее при первом обращении"""
+        if cls._session is None or cls._session.closed:
+            cls._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=32,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60,
+                )
+            )
+        return cls._session
+
+    @classmethod
+    async def close_session(cls) -> None:
+        """Закрывает общую HTTP-сессию (вызывается при остановке бота)"""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+
     def _build_xml_body(
         self,
         book_id_mis: str,
         canceled_reason: str,
         error_data: Optional[Dict[str, Optional[str]]] = None,
-    ) -> str:
+    ) -> bytes:
         """
-        Формирует SOAP XML для CancelAppointmentRequest.
+        Формирует SOAP XML для CancelAppointmentRequest (сразу в UTF-8).
         """
         # Блок Error_Data_Parameters опционален и следует примеру с префиксом v2
-        error_block = ""
+        error_block = b""
         if error_data:
-            msg = error_data.get("message") or ""
-            path = error_data.get("path") or ""
-            value = error_data.get("value") or ""
-            error_block = (
-                "<v2:Error_Data_Parameters>"
-                "<v2:Parameter>"
-                f"<v2:Message>{msg}</v2:Message>"
-                f"<v2:Path>{path}</v2:Path>"
-                f"<v2:Value>{value}</v2:Value>"
-                "</v2:Parameter>"
-                "</v2:Error_Data_Parameters>"
+            error_block = self._ERROR_BLOCK_TEMPLATE % (
+                _xml_value(error_data.get("message")),
+                _xml_value(error_data.get("path")),
+                _xml_value(error_data.get("value")),
             )
 
-        body = (
-            "<v2:CancelAppointmentRequest>"
-            f"<v2:Book_Id_Mis>{book_id_mis}</v2:Book_Id_Mis>"
-            f"<v2:Canceled_Reason>{canceled_reason}</v2:Canceled_Reason>"
-            f"{error_block}"
-            "</v2:CancelAppointmentRequest>"
-        )
-
-        # Формируем SOAP Envelope как в предоставленном рабочем запросе
-        envelope = (
-            '<?xml version="1.0" encoding="UTF-8"?>'
-            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
-            'xmlns:v2="http://www.rt-eu.ru/med/er/v2_0">'
-            "<soapenv:Header/>"
-            f"<soapenv:Body>{body}</soapenv:Body>"
-            "</soapenv:Envelope>"
+        return self._ENVELOPE_TEMPLATE % (
+            _xml_value(book_id_mis),
+            _xml_value(canceled_reason),
+            error_block,
         )
-        return envelope
 
     async def send_cancel_request(
         self,
@@ -120,35 +158,35 @@ class CancelService:
 
         try:
             timeout = aiohttp.ClientTimeout(total=self.timeout_seconds)
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.endpoint_url,
-                    data=payload.encode("utf-8"),
-                    headers=headers,
-                    timeout=timeout,
-                    # TODO: при необходимости добавить ssl=SSLContext(...) для клиентских сертификатов
-                ) as response:
-                    text = await response.text()
-                    success = 200 <= response.status < 300
-
-                    if success:
-                        logger.info(
-                            "SOAP отмена записи выполнена успешно: status=%s, Book_Id_Mis=%s",
-                            response.status,
-                            book_id_mis,
-                        )
-                    else:
-                        logger.error(
-                            "SOAP отмена записи завершилась ошибкой: status=%s, body=%s",
-                            response.status,
-                            text[:500],
-                        )
-
-                    return {
-                        "success": success,
-                        "status": response.status,
-                        "response": text,
-                    }
+            session = await self._get_session()
+            async with session.post(
+                self.endpoint_url,
+                data=payload,
+                headers=headers,
+                timeout=timeout,
+                # TODO: при необходимости добавить ssl=SSLContext(...) для клиентских сертификатов
+            ) as response:
+                text = await response.text()
+                success = 200 <= response.status < 300
+
+                if success:
+                    logger.info(
+                        "SOAP отмена записи выполнена успешно: status=%s, Book_Id_Mis=%s",
+                        response.status,
+                        book_id_mis,
+                    )
+                else:
+                    logger.error(
+                        "SOAP отмена записи завершилась ошибкой: status=%s, body=%s",
+                        response.status,
+                        text[:500],
+                    )
+
+                return {
+                    "success": success,
+                    "status": response.status,
+                    "response": text,
+                }
 
         except Exception as e:
             logger.error("Ошибка при отправке SOAP отмены записи: %s", e, exc_info=True)
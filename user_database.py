@@ -1,7 +1,17 @@
 import os
 import re
+import time
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Tuple
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 from dotenv import load_dotenv
 from logging_config import log_system_event
 
@@ -13,30 +23,124 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
+# Потоки для запросов к БД из асинхронного кода (см. run_db)
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+# Размер пула считается от числа потоков: по соединению на каждый поток run_db
+# и одно для потока event loop, поэтому пул не может исчерпаться
+DB_POOL_MAX_CONN = DB_EXECUTOR_WORKERS + 1
+
+# Кеш имени для приветствия (используется при каждом показе главного меню)
+GREETING_CACHE_TTL_SEC = 600
+GREETING_CACHE_MAX_SIZE = 50000
+
+
+class _ThreadConnection:
+    """Метка соединения потока: удаляется вместе с данными потока и возвращает соединение в пул"""
+    __slots__ = ("__weakref__",)
 
 
 class UserDatabase:
     def __init__(self):
-        self.conn = None
-        self.cursor = None
+        self._pool = None
+        self._local = threading.local()
+        # user_id -> (момент истечения по time.monotonic(), имя для приветствия)
+        self._greeting_cache = {}
         self._connect()
         self._init_db()
         self._create_reminders_table()  # ← создаём таблицу напоминаний
         self._create_mvp_tables()       # ← создаём таблицы для MVP функционала (подписание, телемед, направления, записи)
 
+    @property
+    def conn(self):
+        """
+        Соединение текущего потока из пула.
+        Транзакция в psycopg2 общая на соединение, поэтому потоки не делят одно соединение:
+        rollback или ошибка в одном потоке отменяли бы незакоммиченные изменения другого.
+        Вызовы через run_db берут соединение на время вызова (см. _call_connection),
+        поток event loop держит своё соединение постоянно; у прочих потоков соединение
+        возвращается в пул, когда поток завершается.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None and self._pool is not None:
+            try:
+                conn = self._pool.getconn()
+            except psycopg2.pool.PoolError as e:
+                log_system_event("database", "user_db_pool_exhausted", error=str(e))
+                return None
+            holder = _ThreadConnection()
+            weakref.finalize(holder, self._release_connection, conn)
+            self._local.holder = holder
+            self._local.conn = conn
+        return conn
+
+    @property
+    def cursor(self):
+        """Курсор текущего потока (на соединении этого потока)"""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            conn = self.conn
+            if conn is None:
+                # Ошибка psycopg2, чтобы её обработали обычные except psycopg2.Error
+                raise psycopg2.pool.PoolError("нет соединения с БД пользователей")
+            cursor = conn.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    def _rollback(self):
+        """Откатывает транзакцию текущего потока, если соединение есть"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error as e:
+                log_system_event("database", "user_db_rollback_failed", error=str(e))
+
+    @contextmanager
+    def _call_connection(self):
+        """
+        Соединение из пула на время одного вызова в потоке run_db.
+        Незавершённая транзакция (чтение без commit) откатывается перед возвратом
+        соединения, чтобы оно не оставалось "idle in transaction" с удержанием блокировок.
+        """
+        conn = self._pool.getconn() if self._pool is not None else None
+        self._local.conn = conn
+        try:
+            yield
+        finally:
+            self._local.conn = None
+            self._local.cursor = None
+            if conn is not None:
+                try:
+                    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                finally:
+                    self._pool.putconn(conn)
+
+    def _call(self, func, args, kwargs):
+        """Выполняет синхронный вызов БД на отдельном соединении из пула (в потоке run_db)"""
+        with self._call_connection():
+            return func(*args, **kwargs)
+
+    def _release_connection(self, conn):
+        """Возвращает соединение завершившегося потока в пул"""
+        pool = self._pool
+        if pool is not None and not pool.closed:
+            pool.putconn(conn)
+
     # ---------------------------------------------------------------------
     # Подключение
     # ---------------------------------------------------------------------
     def _connect(self):
         try:
-            self.conn = psycopg2.connect(
+            self._pool = psycopg2.pool.ThreadedConnectionPool(
+                1,
+                DB_POOL_MAX_CONN,
                 dbname=DB_NAME,
                 user=DB_USER,
                 password=DB_PASSWORD,
                 host=DB_HOST,
                 port=DB_PORT
             )
-            self.cursor = self.conn.cursor()
             log_system_event("database", "user_db_connected")
         except psycopg2.Error as e:
             log_system_event("database", "user_db_connection_failed", error=str(e))
@@ -72,8 +176,7 @@ class UserDatabase:
             log_system_event("database", "users_table_initialized")
         except psycopg2.Error as e:
             log_system_event("database", "users_table_init_error", error=str(e))
-            if self.conn:
-                self.conn.rollback()
+            self._rollback()
 
     # ---------------------------------------------------------------------
     # Создание таблицы user_reminders
@@ -101,7 +204,7 @@ class UserDatabase:
             log_system_event("database", "reminders_table_initialized")
         except psycopg2.Error as e:
             log_system_event("database", "reminders_table_init_error", error=str(e))
-            self.conn.rollback()
+            self._rollback()
 
     # ---------------------------------------------------------------------
     # Создание таблиц для MVP (подписание, телемед, направления, записи)
@@ -296,7 +399,7 @@ class UserDatabase:
             log_system_event("database", "mvp_tables_initialized")
         except psycopg2.Error as e:
             log_system_event("database", "mvp_tables_init_error", error=str(e))
-            self.conn.rollback()
+            self._rollback()
 
     def _migrate_appointments_book_id_mis(self):
         """
@@ -353,8 +456,7 @@ class UserDatabase:
             log_system_event("database", "appointments_book_id_mis_migrated")
         except Exception as e:
             log_system_event("database", "appointments_book_id_mis_migration_failed", error=str(e))
-            if self.conn:
-                self.conn.rollback()
+            self._rollback()
 
     def _ensure_unique_constraint_user_book_id_mis(self):
         """
@@ -408,8 +510,7 @@ class UserDatabase:
             log_system_event("database", "appointments_book_id_mis_unique_added")
         except Exception as e:
             log_system_event("database", "appointments_book_id_mis_unique_failed", error=str(e))
-            if self.conn:
-                self.conn.rollback()
+            self._rollback()
 
     def _dedupe_appointments_by_book_id_mis(self):
         """
@@ -556,8 +657,7 @@ class UserDatabase:
             log_system_event("database", "appointments_book_id_mis_dedup_done", groups=len(groups))
         except Exception as e:
             log_system_event("database", "appointments_book_id_mis_dedup_failed", error=str(e))
-            if self.conn:
-                self.conn.rollback()
+            self._rollback()
 
     # ---------------------------------------------------------------------
     # Создание записи для нового пользователя
@@ -597,7 +697,7 @@ class UserDatabase:
 
         except psycopg2.Error as e:
             log_system_event("database", "reminder_record_create_error", error=str(e), user_id=user_id)
-            self.conn.rollback()
+            self._rollback()
 
     # ---------------------------------------------------------------------
     # Получение полных данных пользователя для записи к врачу
@@ -656,6 +756,14 @@ class UserDatabase:
         Возвращает TRUE/FALSE.
         Если записи нет — создаёт по умолчанию TRUE (только для зарегистрированных пользователей).
         """
+        return self.fetch_reminders_status(user_id)[0]
+
+    def fetch_reminders_status(self, user_id: int) -> Tuple[bool, bool]:
+        """
+        Возвращает (статус, прочитан_из_таблицы).
+        Второй элемент False, если вернулось значение по умолчанию (нет пользователя,
+        нет записи или ошибка БД) — такой статус нельзя кешировать.
+        """
         try:
             # Проверка существования пользователя в users
             self.cursor.execute(
@@ -664,7 +772,7 @@ class UserDatabase:
             )
             if not self.cursor.fetchone():
                 log_system_event("database", "get_reminders_status_skipped", reason="user_not_found", user_id=user_id)
-                return True  # безопасное значение по умолчанию
+                return True, False  # безопасное значение по умолчанию
             
             self.cursor.execute(
                 "SELECT enabled FROM user_reminders WHERE user_id = %s",
@@ -675,21 +783,22 @@ class UserDatabase:
             if not row:
                 # создаём запись по умолчанию (только если пользователь зарегистрирован)
                 self.init_user_reminder_record(user_id)
-                return True
+                return True, False
 
-            return row[0]
+            return row[0], True
 
         except psycopg2.Error as e:
             log_system_event("database", "get_reminders_status_error", error=str(e), user_id=user_id)
-            return True  # безопасное значение по умолчанию
+            return True, False  # безопасное значение по умолчанию
 
     # ---------------------------------------------------------------------
     # Установка статуса
     # ---------------------------------------------------------------------
-    def set_reminders_status(self, user_id: int, enabled: bool):
+    def set_reminders_status(self, user_id: int, enabled: bool) -> bool:
         """
         Устанавливает статус напоминаний для пользователя.
         ВАЖНО: Проверяет существование пользователя в таблице users перед операцией.
+        Возвращает True, если статус записан в БД.
         """
         try:
             # Проверка существования пользователя в users
@@ -699,7 +808,7 @@ class UserDatabase:
             )
             if not self.cursor.fetchone():
                 log_system_event("database", "reminders_status_update_skipped", reason="user_not_found", user_id=user_id)
-                return  # пользователь не зарегистрирован
+                return False  # пользователь не зарегистрирован
             
             self.cursor.execute(
                 """
@@ -712,10 +821,12 @@ class UserDatabase:
             )
             self.conn.commit()
             log_system_event("database", "reminders_status_updated", user_id=user_id, enabled=enabled)
+            return True
 
         except psycopg2.Error as e:
             log_system_event("database", "reminders_status_update_error", error=str(e), user_id=user_id)
-            self.conn.rollback()
+            self._rollback()
+            return False
 
     # ---------------------------------------------------------------------
     # Остальной исходный код
@@ -738,8 +849,7 @@ class UserDatabase:
                 log_system_event("database", "column_added", column=column_name, table=table_name)
         except psycopg2.Error as e:
             log_system_event("database", "column_add_error", error=str(e), column=column_name, table=table_name)
-            if self.conn:
-                self.conn.rollback()
+            self._rollback()
 
     # ----- Оригинальные методы регистрации/валидации (не менялись) -----
 
@@ -754,7 +864,7 @@ class UserDatabase:
             # Если транзакция прервана - делаем rollback и повторяем запрос
             if "текущая транзакция прервана" in error_msg or "current transaction is aborted" in error_msg.lower():
                 try:
-                    self.conn.rollback()
+                    self._rollback()
                     # Повторяем запрос после rollback
                     self.cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
                     result = self.cursor.fetchone() is not None
@@ -767,16 +877,25 @@ class UserDatabase:
             return False
 
     def get_user_greeting(self, user_id: int) -> str:
+        cached = self._greeting_cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
         try:
             self.cursor.execute("SELECT fio FROM users WHERE user_id = %s", (user_id,))
             row = self.cursor.fetchone()
             if not row:
                 return "гость"
             fio = row[0].split()
-            return " ".join(fio[1:]) if len(fio) >= 2 else fio[0]
+            greeting = " ".join(fio[1:]) if len(fio) >= 2 else fio[0]
         except psycopg2.Error:
             return "гость"
 
+        if len(self._greeting_cache) >= GREETING_CACHE_MAX_SIZE:
+            # Вытесняем самую старую запись (словарь хранит порядок вставки)
+            self._greeting_cache.pop(next(iter(self._greeting_cache)), None)
+        self._greeting_cache[user_id] = (time.monotonic() + GREETING_CACHE_TTL_SEC, greeting)
+        return greeting
+
     def update_last_chat_id(self, user_id: int, chat_id: int):
         """Обновляет последний известный chat_id пользователя"""
         try:
@@ -787,7 +906,7 @@ class UserDatabase:
             self.conn.commit()
         except psycopg2.Error as e:
             log_system_event("database", "update_last_chat_id_failed", error=str(e), user_id=user_id)
-            self.conn.rollback()
+            self._rollback()
 
     def get_last_chat_id(self, user_id: int) -> int:
         """Получает последний известный chat_id пользователя"""
@@ -901,6 +1020,7 @@ class UserDatabase:
                 (user_id, chat_id, fio, phone_cleaned, birth_date, snils_cleaned, oms_cleaned, gender, reg_date)
             )
             self.conn.commit()
+            self._greeting_cache.pop(user_id, None)
 
             # ⚡ Создаём запись о напоминаниях
             self.init_user_reminder_record(user_id)
@@ -909,7 +1029,7 @@ class UserDatabase:
 
         except psycopg2.Error as e:
             log_system_event("database", "user_registration_failed", error=str(e), user_id=user_id)
-            self.conn.rollback()
+            self._rollback()
             return False
 
     def update_user_data(self, user_id: int, fio: str, birth_date: str, snils: str = None, oms: str = None, gender: str = None) -> bool:
@@ -933,11 +1053,12 @@ class UserDatabase:
                 (fio, birth_date, snils_cleaned, oms_cleaned, gender, user_id)
             )
             self.conn.commit()
+            self._greeting_cache.pop(user_id, None)
             log_system_event("database", "user_data_updated", user_id=user_id)
             return True
         except psycopg2.Error as e:
             log_system_event("database", "user_update_failed", error=str(e), user_id=user_id)
-            self.conn.rollback()
+            self._rollback()
             return False
 
     def add_appointment(self, user_id: int, appointment_data: dict, booking_source: str = 'self_bot') -> bool:
@@ -1060,8 +1181,7 @@ class UserDatabase:
             pgcode = getattr(e, "pgcode", None)
             if pgcode == "23505" and constraint == "idx_appointments_user_visit_mo":
                 try:
-                    if self.conn:
-                        self.conn.rollback()
+                    self._rollback()
 
                     # Находим существующую запись по ключу (user_id, visit_time, mo_name)
                     self.cursor.execute(
@@ -1109,25 +1229,34 @@ class UserDatabase:
                     return True
                 except Exception as inner:
                     log_system_event("database", "appointment_add_failed", error=str(inner), user_id=user_id)
-                    if self.conn:
-                        self.conn.rollback()
+                    self._rollback()
                     return False
 
             log_system_event("database", "appointment_add_failed", error=str(e), user_id=user_id)
-            if self.conn:
-                self.conn.rollback()
+            self._rollback()
             return False
         except psycopg2.Error as e:
             log_system_event("database", "appointment_add_failed", error=str(e), user_id=user_id)
-            self.conn.rollback()
+            self._rollback()
             return False
 
     def close_connection(self):
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
+        if self._pool is not None and not self._pool.closed:
+            self._pool.closeall()
 
 
 # Экземпляр базы данных
 db = UserDatabase()
+
+# Ограниченный пул потоков для запросов к БД: его размер задаёт размер пула соединений
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="user-db")
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию, работающую с БД пользователей, вне event loop.
+    Вызов получает своё соединение из пула и свою транзакцию (вместо asyncio.to_thread,
+    потоки которого не связаны с размером пула соединений).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(db._call, func, args, kwargs))